@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Aggregate evaluation results by task, task type, answer type and task parameter values.
+
+Computes counts and pass rates for every group in a single streaming pass over the results
+of an evaluation report (.json or .jsonl), which is where to look first for failure patterns.
+
+Example usage:
+python aggregate_results.py -t tasks.json results.json
+python aggregate_results.py -t tasks.json results.jsonl -o aggregates.json --parameters Course
+"""
+
+import argparse
+import json
+from typing import Dict, Iterable, List, Optional
+
+from core import Evaluator, Task, iter_results
+
+
+UNKNOWN = 'Unknown'
+
+
+def aggregate_results(results: Iterable[Dict], parameters: Optional[List[str]] = None) -> Dict:
+    """
+    Group task instance eval results in a single pass.
+
+    Args:
+        results: Task instance eval results, the 'details' of an evaluation report
+        parameters: Task parameters (keys of the instance 'mapping') to group by, all of them if None
+
+    Returns:
+        Dict with 'by_task', 'by_type', 'by_answer_type' and 'by_parameter' groups, each group holding
+        correct, incorrect, total and %_correct
+    """
+    counts = {
+        'by_task': {},
+        'by_type': {},
+        'by_answer_type': {},
+        'by_parameter': {}
+    }
+
+    tasks = {}
+
+    def count(groups, key, correct):
+        group = groups.setdefault(key, [0, 0])
+        group[0 if correct else 1] += 1
+
+    for result in results:
+        instance = Task.ALL_TASK_INSTANCES.get(result['id'])
+        task = instance.parent_task if instance is not None else None
+        correct = result['correct']
+
+        if task is not None:
+            tasks[task.id] = task
+
+        count(counts['by_task'], task.id if task is not None else UNKNOWN, correct)
+        count(counts['by_type'], task.type if task is not None else UNKNOWN, correct)
+        count(counts['by_answer_type'], str(getattr(task, 'answer_type', None)) if task is not None else UNKNOWN, correct)
+
+        if instance is not None:
+            for parameter, value in instance.mapping.items():
+                if parameters is None or parameter in parameters:
+                    count(counts['by_parameter'].setdefault(parameter, {}), str(value), correct)
+
+    def totals(groups):
+        return {key: Evaluator.totals(correct, incorrect) for key, (correct, incorrect) in groups.items()}
+
+    aggregates = {
+        'by_task': totals(counts['by_task']),
+        'by_type': totals(counts['by_type']),
+        'by_answer_type': totals(counts['by_answer_type']),
+        'by_parameter': {parameter: totals(groups) for parameter, groups in counts['by_parameter'].items()}
+    }
+
+    # Make task groups readable on their own.
+    for task_id, group in aggregates['by_task'].items():
+        if task_id in tasks:
+            group['parameterized_text'] = tasks[task_id].parameterized_text
+
+    return aggregates
+
+
+def print_groups(title: str, groups: Dict, label=lambda key, group: key):
+    print(f"\n{title:-^100}")
+    # Lowest pass rates first, that's where the failure patterns are.
+    for key, group in sorted(groups.items(), key=lambda item: (item[1]['correct'] / item[1]['total'], item[0])):
+        print(f"{str(group['%_correct']) + '%':>8} {str(group['correct']) + '/' + str(group['total']):>9} | {label(key, group)}")
+
+
+def print_aggregates(aggregates: Dict, parameters: Optional[List[str]] = None):
+    """Print the aggregates, only printing the parameter groups listed in parameters, if given."""
+    print_groups('BY TASK', aggregates['by_task'], lambda key, group: group.get('parameterized_text', key))
+    print_groups('BY TYPE', aggregates['by_type'])
+    print_groups('BY ANSWER TYPE', aggregates['by_answer_type'])
+    for parameter, groups in aggregates['by_parameter'].items():
+        if parameters is None or parameter in parameters:
+            print_groups(f"BY {parameter.upper()}", groups)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate evaluation results by task, type, answer type and parameter values.')
+    parser.add_argument('results_file', help='Path to an evaluation report (.json or .jsonl)')
+    parser.add_argument('-t', '--tasks', dest='tasks_file', required=True, help='Path to the tasks.json file the results were evaluated against')
+    parser.add_argument('-p', '--parameters', nargs='+', help='Task parameters to group by (eg: Course), all of them by default')
+    parser.add_argument('-o', '--output', help='Optional JSON output file')
+
+    args = parser.parse_args()
+
+    with open(args.tasks_file, 'r') as f:
+        [Task(x) for x in json.load(f)]
+
+    aggregates = aggregate_results(iter_results(args.results_file), args.parameters)
+
+    print_aggregates(aggregates)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(aggregates, f, indent=4)
+        print(f"\nAggregates written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
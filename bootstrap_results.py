@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Bootstrap confidence intervals and paired significance tests for evaluation runs.
+
+Evaluation sets are small (eg: ~46 instances for CASCON 2026), so differences in %_correct between
+agents are often noise. This script resamples tasks with replacement, keeping all instances of a
+task together, to estimate a confidence interval for the pass rate of every run, and tests the
+difference in pass rate between pairs of runs on the same resamples (a paired bootstrap).
+
+Resampling is vectorized with NumPy: each bootstrap iteration is a row of per-task draw counts, so
+the pass rates of every run in every iteration come out of a single matrix product.
+
+Example usage:
+python bootstrap_results.py -t tasks.json run_a.json run_b.json run_c.jsonl
+python bootstrap_results.py -t tasks.json --baseline run_a.json -n 10000 -o bootstrap.json run_a.json run_b.json run_c.jsonl
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+from core import Task, iter_results
+
+
+def load_runs(results_files: List[str]) -> Dict[str, Dict[str, bool]]:
+    """Load the task instance verdicts of each run."""
+    runs = {}
+    for results_file in results_files:
+        try:
+            runs[results_file] = {result['id']: bool(result['correct']) for result in iter_results(results_file)}
+        except Exception as e:
+            print(f"Error loading {results_file}: {e}")
+            sys.exit(1)
+    return runs
+
+
+def task_matrices(runs: Dict[str, Dict[str, bool]]):
+    """
+    Aggregate instance verdicts to tasks.
+
+    Instances that are not part of the loaded task pack are treated as tasks of their own.
+
+    Returns:
+        task ids, and (runs x tasks) matrices of passed and evaluated instance counts
+    """
+    def task_of(instance_id):
+        instance = Task.ALL_TASK_INSTANCES.get(instance_id)
+        return instance.parent_task.id if instance is not None else instance_id
+
+    task_ids = sorted(set(task_of(instance_id) for results in runs.values() for instance_id in results))
+    positions = {task_id: i for i, task_id in enumerate(task_ids)}
+
+    passed = np.zeros((len(runs), len(task_ids)))
+    evaluated = np.zeros((len(runs), len(task_ids)))
+
+    for r, results in enumerate(runs.values()):
+        for instance_id, correct in results.items():
+            t = positions[task_of(instance_id)]
+            evaluated[r, t] += 1
+            passed[r, t] += correct
+
+    return task_ids, passed, evaluated
+
+
+def bootstrap_pass_rates(passed: np.ndarray, evaluated: np.ndarray, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Resample tasks with replacement and compute the pass rate of every run in every resample.
+
+    Returns:
+        (iterations x runs) matrix of pass rates, NaN where a run has no instances in a resample
+    """
+    number_of_tasks = passed.shape[1]
+    draws = rng.multinomial(number_of_tasks, np.full(number_of_tasks, 1 / number_of_tasks), size=iterations)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (draws @ passed.T) / (draws @ evaluated.T)
+
+
+def paired_tests(names: List[str], observed: np.ndarray, rates: np.ndarray, pairs: List, alpha: float, chunk_size: int = 1000) -> List[Dict]:
+    """
+    Paired bootstrap test of the difference in pass rate for each pair of runs.
+
+    The p-value is two-sided: twice the fraction of resamples on the far side of zero from the observed difference.
+    """
+    tests = []
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start:start + chunk_size]
+        first = np.array([i for i, _ in chunk])
+        second = np.array([j for _, j in chunk])
+
+        differences = rates[:, first] - rates[:, second]
+        lower, upper = np.nanpercentile(differences, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        at_or_below = np.nanmean(differences <= 0, axis=0)
+        at_or_above = np.nanmean(differences >= 0, axis=0)
+        p_values = np.minimum(1.0, 2 * np.minimum(at_or_below, at_or_above))
+
+        for k, (i, j) in enumerate(chunk):
+            tests.append({
+                'first': names[i],
+                'second': names[j],
+                'difference': round(float(observed[i] - observed[j]) * 100, 2),
+                'ci_lower': round(float(lower[k]) * 100, 2),
+                'ci_upper': round(float(upper[k]) * 100, 2),
+                'p_value': round(float(p_values[k]), 4)
+            })
+
+    return tests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bootstrap confidence intervals and paired significance tests for evaluation runs, resampling at task level.')
+    parser.add_argument('results_files', nargs='+', help='Paths to evaluation reports (.json or .jsonl)')
+    parser.add_argument('-t', '--tasks', dest='tasks_file', required=True, help='Path to the tasks.json file, used to group task instances by task')
+    parser.add_argument('-n', '--iterations', type=int, default=10000, help='Number of bootstrap iterations (default: 10000)')
+    parser.add_argument('-c', '--confidence', type=float, default=0.95, help='Confidence level of the intervals (default: 0.95)')
+    parser.add_argument('--baseline', help='Only test the other runs against this run, rather than every pair of runs')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed, for reproducible results')
+    parser.add_argument('-o', '--output', help='Optional JSON output file')
+
+    args = parser.parse_args()
+
+    with open(args.tasks_file, 'r') as f:
+        [Task(x) for x in json.load(f)]
+
+    runs = load_runs(args.results_files)
+    names = list(runs.keys())
+
+    if args.baseline is not None and args.baseline not in runs:
+        parser.error(f"The baseline {args.baseline} must be one of the result files.")
+
+    task_ids, passed, evaluated = task_matrices(runs)
+
+    # Paired tests assume both runs evaluated the same tasks.
+    covered = evaluated > 0
+    for r, name in enumerate(names):
+        if not np.array_equal(covered[r], covered.any(axis=0)):
+            print(f"Warning: {name} only covers {int(covered[r].sum())} of {len(task_ids)} tasks, paired tests involving it compare pass rates over different tasks.")
+
+    alpha = 1 - args.confidence
+    rng = np.random.default_rng(args.seed)
+
+    observed = passed.sum(axis=1) / evaluated.sum(axis=1)
+    rates = bootstrap_pass_rates(passed, evaluated, args.iterations, rng)
+    lower, upper = np.nanpercentile(rates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+
+    intervals = [
+        {
+            'run': name,
+            'instances': int(evaluated[r].sum()),
+            'tasks': int(covered[r].sum()),
+            '%_correct': round(float(observed[r]) * 100, 2),
+            'ci_lower': round(float(lower[r]) * 100, 2),
+            'ci_upper': round(float(upper[r]) * 100, 2)
+        }
+        for r, name in enumerate(names)
+    ]
+
+    if args.baseline is not None:
+        baseline = names.index(args.baseline)
+        pairs = [(baseline, j) for j in range(len(names)) if j != baseline]
+    else:
+        pairs = [(i, j) for i in range(len(names)) for j in range(i + 1, len(names))]
+
+    tests = paired_tests(names, observed, rates, pairs, alpha)
+
+    confidence = round(args.confidence * 100, 2)
+    print(f"Pass rates with {confidence}% bootstrap confidence intervals ({args.iterations} iterations over {len(task_ids)} tasks):")
+    for interval in intervals:
+        print(f"  {interval['run']}: {interval['%_correct']}% [{interval['ci_lower']}%, {interval['ci_upper']}%] ({interval['instances']} instances, {interval['tasks']} tasks)")
+
+    print("\nPaired differences in pass rate:")
+    for test in tests:
+        print(f"  {test['first']} - {test['second']}: {test['difference']}% [{test['ci_lower']}%, {test['ci_upper']}%] p={test['p_value']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'iterations': args.iterations,
+                'confidence': args.confidence,
+                'tasks': len(task_ids),
+                'runs': intervals,
+                'paired_tests': tests
+            }, f, indent=4)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
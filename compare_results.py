@@ -3,13 +3,14 @@ import argparse
 import json
 import yaml
 import sys
+from functools import reduce
+
+from core import iter_results
 
 def load_results(file_path):
-    """Load results from a JSON file."""
+    """Load results from a .json or .jsonl report."""
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            return {task['id']: task['correct'] for task in data['details']}
+        return {task['id']: task['correct'] for task in iter_results(file_path)}
     except Exception as e:
         print(f"Error loading {file_path}: {e}")
         sys.exit(1)
@@ -93,28 +94,126 @@ def compare_results(first_results, second_results, first_filename, second_filena
     
     return categories, stats
 
+def build_bitsets(runs):
+    """
+    Index the instance ids of all runs and represent each run as two bitsets over that index:
+    the instances it evaluated, and the instances it solved. Bit i refers to instance_ids[i].
+    """
+    instance_ids = sorted(set().union(*[results.keys() for results in runs.values()]))
+    positions = {instance_id: i for i, instance_id in enumerate(instance_ids)}
+
+    evaluated = {}
+    solved = {}
+    for name, results in runs.items():
+        evaluated[name] = sum(1 << positions[instance_id] for instance_id in results)
+        solved[name] = sum(1 << positions[instance_id] for instance_id, correct in results.items() if correct)
+
+    return instance_ids, evaluated, solved
+
+def compare_runs(runs, task_mapping=None):
+    """
+    Compare any number of runs, given as a dict of run name -> {instance id: correct}.
+
+    Every category is computed with bit operations over the per-run bitsets, so the cost of a comparison
+    grows with the number of runs rather than with the number of instance lookups.
+    Instances a run did not evaluate count as not solved by that run.
+    """
+    if task_mapping is None:
+        task_mapping = {}
+
+    instance_ids, evaluated, solved = build_bitsets(runs)
+    names = list(runs.keys())
+
+    def entries(bitset):
+        result = []
+        while bitset:
+            lowest = bitset & -bitset
+            instance_id = instance_ids[lowest.bit_length() - 1]
+            task_entry = {'id': instance_id}
+            if instance_id in task_mapping:
+                task_entry['instance_text'] = task_mapping[instance_id]
+            result.append(task_entry)
+            bitset ^= lowest
+        return result
+
+    evaluated_by_all = reduce(lambda a, b: a & b, evaluated.values())
+    solved_by_any = reduce(lambda a, b: a | b, solved.values())
+    solved_by_all = reduce(lambda a, b: a & b, solved.values())
+    solved_by_none = reduce(lambda a, b: a | b, evaluated.values()) & ~solved_by_any
+
+    solved_only_by = {}
+    for name in names:
+        solved_by_others = reduce(lambda a, b: a | b, [solved[other] for other in names if other != name], 0)
+        solved_only_by[name] = solved[name] & ~solved_by_others
+
+    # Agreement between two runs is measured over the instances both of them evaluated.
+    pairwise_agreement = {}
+    for first in names:
+        pairwise_agreement[first] = {}
+        for second in names:
+            both = evaluated[first] & evaluated[second]
+            agree = both & ~(solved[first] ^ solved[second])
+            pairwise_agreement[first][second] = round(agree.bit_count() / both.bit_count(), 4) if both else None
+
+    categories = {
+        'solved_by_all': entries(solved_by_all),
+        'solved_by_none': entries(solved_by_none),
+        'solved_only_by': {name: entries(solved_only_by[name]) for name in names},
+        'pairwise_agreement': pairwise_agreement
+    }
+
+    stats = {
+        'instances': len(instance_ids),
+        'evaluated_by_all': evaluated_by_all.bit_count(),
+        'solved_by_all': solved_by_all.bit_count(),
+        'solved_by_none': solved_by_none.bit_count(),
+        'solved_by_any': solved_by_any.bit_count(),
+        'solved_only_by': {name: solved_only_by[name].bit_count() for name in names},
+        'runs': {
+            name: {
+                'evaluated': evaluated[name].bit_count(),
+                'solved': solved[name].bit_count(),
+                '%_correct': round(solved[name].bit_count() / evaluated[name].bit_count() * 100, 2) if evaluated[name] else 'N/A'
+            }
+            for name in names
+        }
+    }
+
+    return categories, stats
+
 def main():
-    parser = argparse.ArgumentParser(description='Compare two result files.')
-    parser.add_argument('first_file', help='Path to the first result file')
-    parser.add_argument('second_file', help='Path to the second result file')
+    parser = argparse.ArgumentParser(description='Compare two or more result files.')
+    parser.add_argument('result_files', nargs='+', help='Paths to the result files (.json or .jsonl) to compare')
     parser.add_argument('--tasks', '-t', help='Path to the tasks YAML file for instance text lookup')
     parser.add_argument('--output', '-o', default='comparison.yaml', help='Output YAML file path')
     
     args = parser.parse_args()
-    
-    first_results = load_results(args.first_file)
-    second_results = load_results(args.second_file)
+
+    if len(args.result_files) < 2:
+        parser.error("At least two result files are needed for a comparison.")
+
+    runs = {file_path: load_results(file_path) for file_path in args.result_files}
     
     task_mapping = {}
     if args.tasks:
         task_mapping = load_tasks(args.tasks)
     
-    categories, stats = compare_results(first_results, second_results, args.first_file, args.second_file, task_mapping)
-    
+    categories, stats = compare_runs(runs, task_mapping)
+
     output_data = {
         **categories,
         'statistics': stats
     }
+
+    # Keep the categories of the original two-way comparison when comparing exactly two runs.
+    if len(args.result_files) == 2:
+        first_file, second_file = args.result_files
+        two_way_categories, two_way_stats = compare_results(runs[first_file], runs[second_file], first_file, second_file, task_mapping)
+        output_data = {
+            **two_way_categories,
+            **output_data,
+            'statistics': {**two_way_stats, **stats}
+        }
     
     with open(args.output, 'w') as f:
         yaml.dump(output_data, f, default_flow_style=False)
@@ -1,6 +1,9 @@
 import json
+import hashlib
+import os
 import re
 import regex
+import time
 from zoneinfo import ZoneInfo
 from datetime import datetime
 from urllib.parse import urlparse
@@ -32,6 +35,22 @@ class Task:
         for instance in self.instances:
             Task.ALL_TASK_INSTANCES[instance.id] = instance
 
+    '''
+    Artifact file and folder names produced by agents contain the id of the task instance they were produced for.
+    Returns the id of the known task instance appearing in the given path, or None if there isn't one.
+    '''
+    @staticmethod
+    def resolve_instance_id(path):
+        return next((instance_id for instance_id in Task.ALL_TASK_INSTANCES if instance_id in path), None)
+
+    '''
+    Deterministically assigns a task instance to one of number_of_shards shards by hashing its id, so that several machines
+    can each evaluate a disjoint subset of task instances without coordinating.
+    '''
+    @staticmethod
+    def shard_of(instance_id, number_of_shards):
+        return int(hashlib.sha1(instance_id.encode('utf-8')).hexdigest(), 16) % number_of_shards
+
 
 class TaskInstance:
 
@@ -41,6 +60,7 @@ class TaskInstance:
         self.instance_text = data["instance_text"]
         self.mapping = data["mapping"]
         self.answer_options = None
+        self.answer_option_ids = [None]
 
         if parent_task.type == 'Side-effect':
             '''
@@ -53,14 +73,17 @@ class TaskInstance:
             Basically, if an answer key item specifies an answer id, the answers get segregated by id
             and fullfilling anyone of them in full passes the task.
             '''
-            unique_answers = set([x['answer_id'] for x in data["answer_key"] if 'answer_id' in x])
+            unique_answers = sorted(set([x['answer_id'] for x in data["answer_key"] if 'answer_id' in x]))
             if len(unique_answers) > 0:
                 self.answer_options = []
+                self.answer_option_ids = unique_answers
 
                 for a_id in unique_answers:
                     self.answer_options.append([SideEffectAnswer(x) for x in data["answer_key"] if x["answer_id"] == a_id])
             else:
                 self.answer_key = [SideEffectAnswer(x) for x in data["answer_key"]]
+
+            self.index_expected_calls()
         elif parent_task.type == "Information Seeking":
             '''
             If the parent task is an information seeking task the answer key will be a JSON object containing a single key, whose value is either a literal or
@@ -70,6 +93,28 @@ class TaskInstance:
         else:
             print (f"Unknown parent task type: {self.parent_task.type} cannot parse answer_key for task instance {self.id}")
         
+    '''
+    Answer options frequently share most of their expected api calls (eg: the same DELETE membership followed by different POSTs).
+    Deduplicate the expected calls across all options into self.expected_calls, so a network log can be checked against every option
+    in a single pass. Each option is then described by a bitmask over self.expected_calls in self.option_masks.
+
+    Instances without answer options are treated as having a single option made up of their answer_key.
+    '''
+    def index_expected_calls(self):
+        options = self.answer_options if self.answer_options is not None else [self.answer_key]
+
+        self.expected_calls = []
+        self.option_masks = []
+        positions = {}
+
+        for option in options:
+            mask = 0
+            for answer in option:
+                if answer.key() not in positions:
+                    positions[answer.key()] = len(self.expected_calls)
+                    self.expected_calls.append(answer)
+                mask |= 1 << positions[answer.key()]
+            self.option_masks.append(mask)
 
 
 class SideEffectAnswer:
@@ -79,6 +124,10 @@ class SideEffectAnswer:
         self.path = data["path"]
         self.request_kv = data["request_kv"]
 
+    # Two answers with the same key expect the same api call, regardless of which answer option they belong to.
+    def key(self):
+        return (self.method, self.path, json.dumps(self.request_kv, sort_keys=True, default=str))
+
 class InformationSeekingAnswer:
 
     date_format = "%Y-%m-%d %H:%M"
@@ -285,6 +334,18 @@ class NetworkEvent:
             print(f"No query string detected in path: {path}")
             return None, None
 
+    '''
+    Returns true if the request can change state in Canvas. GraphQL requests are all POSTs, only GraphQL mutations count as mutating.
+    '''
+    def is_mutating(self):
+        if self.method not in ['POST', 'PUT', 'PATCH', 'DELETE']:
+            return False
+
+        if self.get_path_without_query() == '/api/graphql' and isinstance(self.request.get('query'), str):
+            return self.request['query'].lstrip().startswith('mutation')
+
+        return True
+
     def get_path_without_query(self):
         try:
             return self.path[0: self.path.index('?')]
@@ -293,13 +354,9 @@ class NetworkEvent:
 
 
     '''
-    Returns true if:
-     - the network event matches the provided path & method
-     - the network event's request contains the the key-value pairs described in request_kv
-    
-    Additionally returns a list of errors, IE: if it returns false, the reasons for returning false will be provided in the error list.
+    Returns the reasons the network event does not match the provided method & path, an empty list if it does.
     '''
-    def matches(self, method, path, request_kv):
+    def match_endpoint(self, method, path):
 
         errors = []
 
@@ -346,7 +403,19 @@ class NetworkEvent:
                 pass
             else:
                 errors.append(f"The expected path was {path} but the observed path was: {self.path}")
-            
+
+        return errors
+
+    '''
+    Returns true if:
+     - the network event matches the provided path & method
+     - the network event's request contains the the key-value pairs described in request_kv
+    
+    Additionally returns a list of errors, IE: if it returns false, the reasons for returning false will be provided in the error list.
+    '''
+    def matches(self, method, path, request_kv):
+
+        errors = self.match_endpoint(method, path)
 
         # Don't bother checking request values if method and path have already mismatched.
         if len(errors) > 0:
@@ -522,9 +591,21 @@ class OdoBotExecutionEventLog:
 
     @staticmethod
     def to_execution_event_log(path):
-        for instance_id in Task.ALL_TASK_INSTANCES:
-            if instance_id in path:
-                return OdoBotExecutionEventLog(open(path, 'r', encoding="utf-8", errors="ignore"), instance_id)
+        instance_id = Task.resolve_instance_id(path)
+        if instance_id is not None:
+            return OdoBotExecutionEventLog(open(path, 'r', encoding="utf-8", errors="ignore"), instance_id)
+
+    # Converts raw OdoBot execution events into NetworkEvents, dropping everything that isn't a network event.
+    @staticmethod
+    def parse_network_events(events):
+        # Filter out everything except NET events. 
+        network_events = [x for x in events if 'name' in x['eventDetails'] and x['eventDetails']['name'] == 'NETWORK_EVENT']
+
+        print(f"# of network_events: {len(network_events)}")
+        if len(network_events)>0:
+            print(network_events[0])
+
+        return [NetworkEvent.from_odobot_event(x) for x in network_events]
 
     def __init__(self, file, instance_id):
         self.task_instance = instance_id
@@ -534,14 +615,7 @@ class OdoBotExecutionEventLog:
         
         print(f"Loading events from: {self.file.name}")
 
-        # Filter out everything except NET events. 
-        self.network_events = [x for x in self.events if 'name' in x['eventDetails'] and x['eventDetails']['name'] == 'NETWORK_EVENT']
-
-        print(f"# of network_events: {len(self.network_events)}")
-        if len(self.network_events)>0:
-            print(self.network_events[0])
-
-        self.network_events = [NetworkEvent.from_odobot_event(x) for x in self.network_events]
+        self.network_events = OdoBotExecutionEventLog.parse_network_events(self.events)
 
         print(f"Loaded {len(self.network_events)} network events from {self.file.name} for task {self.task_instance}")
 
@@ -550,13 +624,24 @@ class WebVoyagerNetworkLog:
 
     @staticmethod
     def to_network_log(path):
-        for instance_id in Task.ALL_TASK_INSTANCES:
-            if instance_id in path:
-                return WebVoyagerNetworkLog(open(path, 'r'), instance_id)
+        instance_id = Task.resolve_instance_id(path)
+        if instance_id is not None:
+            return WebVoyagerNetworkLog(open(path, 'r'), instance_id)
         
         print(f"Path: {path} does not contain any task instance id.")
         return None
 
+    # Converts raw WebVoyager network log entries into NetworkEvents, dropping entries that cannot be processed.
+    @staticmethod
+    def parse_network_events(events):
+        print(f"# of raw network events: {len(events)}")
+        # Now process the network_events into NetworkEvent objects
+        network_events = [NetworkEvent.to_network_event(x) for x in events]
+        network_events = [x for x in network_events if x is not None]
+        print(f"# of processed network events: {len(network_events)}")
+
+        return network_events
+
 
     def __init__(self, file, instance_id):
         self.task_instance = instance_id
@@ -564,15 +649,215 @@ class WebVoyagerNetworkLog:
         self.network_events = json.load(file)
         self.file.close()
 
-        print(f"# of raw network events: {len(self.network_events)}")
-        # Now process the network_events into NetworkEvent objects
-        self.network_events = [NetworkEvent.to_network_event(x) for x in self.network_events]
-        self.network_events = [x for x in self.network_events if x is not None]
-        print(f"# of processed network events: {len(self.network_events)}")
+        self.network_events = WebVoyagerNetworkLog.parse_network_events(self.network_events)
 
         print(f"Loaded {len(self.network_events)} network events from {self.file.name} for task {self.task_instance}")
 
 
+'''
+Token usage of a WebVoyager task execution, read from the token files WebVoyager writes next to its network logs.
+A token file holds one usage record per LLM call, either as a top level list or under a 'calls' (or 'steps') key:
+
+    {"calls": [{"usage": {"prompt_tokens": 1000, "completion_tokens": 100, "prompt_tokens_details": {"cached_tokens": 5}}},
+               {"usage": {"input_tokens": 500, "output_tokens": 50}}],
+     "total": {"prompt_tokens": 1500, "completion_tokens": 150}}
+
+Each record carries its counts directly or in a 'usage' block, named after either the chat completions
+(prompt_tokens/completion_tokens) or responses (input_tokens/output_tokens) convention. Only the top level counts of a
+record are read, so nested detail blocks are not counted again. A file without per call records is read as a single
+record. When the file also stores a 'total', it is checked against the summed records and a mismatch is reported.
+'''
+class WebVoyagerTokenUsage:
+
+    PROMPT_TOKEN_KEYS = ['prompt_tokens', 'input_tokens']
+    COMPLETION_TOKEN_KEYS = ['completion_tokens', 'output_tokens']
+    RECORD_KEYS = ['calls', 'steps']
+
+    @staticmethod
+    def to_token_usage(path):
+        instance_id = Task.resolve_instance_id(path)
+        if instance_id is not None:
+            return WebVoyagerTokenUsage(open(path, 'r'), instance_id)
+
+        print(f"Path: {path} does not contain any task instance id.")
+        return None
+
+    # Returns the (prompt, completion) counts of a single usage record, or (0, 0) if it holds none.
+    @staticmethod
+    def record_tokens(record):
+        if not isinstance(record, dict):
+            return 0, 0
+        usage = record.get('usage', record)
+        if not isinstance(usage, dict):
+            return 0, 0
+
+        prompt_tokens = next((usage[key] for key in WebVoyagerTokenUsage.PROMPT_TOKEN_KEYS if isinstance(usage.get(key), (int, float))), 0)
+        completion_tokens = next((usage[key] for key in WebVoyagerTokenUsage.COMPLETION_TOKEN_KEYS if isinstance(usage.get(key), (int, float))), 0)
+        return prompt_tokens, completion_tokens
+
+    @staticmethod
+    def usage_records(usage):
+        if isinstance(usage, list):
+            return usage
+        if isinstance(usage, dict):
+            for key in WebVoyagerTokenUsage.RECORD_KEYS:
+                if isinstance(usage.get(key), list):
+                    return usage[key]
+            return [usage]
+        return []
+
+    @staticmethod
+    def count_tokens(usage):
+        counts = [WebVoyagerTokenUsage.record_tokens(record) for record in WebVoyagerTokenUsage.usage_records(usage)]
+        return sum(x[0] for x in counts), sum(x[1] for x in counts)
+
+    def __init__(self, file, instance_id):
+        self.task_instance = instance_id
+        self.file = file
+        usage = json.load(file)
+        self.file.close()
+
+        self.prompt_tokens, self.completion_tokens = WebVoyagerTokenUsage.count_tokens(usage)
+
+        if isinstance(usage, dict) and 'total' in usage and WebVoyagerTokenUsage.usage_records(usage) != [usage]:
+            total = WebVoyagerTokenUsage.record_tokens(usage['total'])
+            if total != (self.prompt_tokens, self.completion_tokens):
+                print(f"Token total {total} in {self.file.name} does not match the summed usage records ({self.prompt_tokens}, {self.completion_tokens}), using the summed records.")
+
+        print(f"Loaded token usage from {self.file.name} for task {self.task_instance}: {self.prompt_tokens} prompt tokens, {self.completion_tokens} completion tokens")
+
+
+# Eval result fields needed to summarize the efficiency of a run, see Evaluator.summarize_efficiency()
+EFFICIENCY_METRICS = ["network_event_count", "mutating_request_count", "first_satisfied_event_index", "redundant_mutations", "failed_mutation_attempts"]
+
+# Eval result fields needed to summarize the token usage of a run, see Evaluator.summarize_token_usage()
+TOKEN_USAGE_METRICS = ["prompt_tokens", "completion_tokens", "total_tokens", "estimated_cost"]
+
+'''
+Writes an evaluation report as JSON lines: one line per task instance eval result, written as soon as it is available, followed by a
+summary record {"summary": {"correct": ..., "incorrect": ..., "total": ..., "%_correct": ...}} when the writer is closed.
+Memory stays flat no matter the size of the report, and the results written before a crash survive it.
+
+When the same task instance appears on several lines, for example in watch mode, the last line supersedes the earlier ones.
+'''
+class JsonlResultsWriter:
+
+    def __init__(self, path, metadata=None):
+        self.file = open(path, 'w')
+        self.metadata = metadata if metadata is not None else {}
+        self.correct = {}
+        self.result_metrics = {}
+
+    def write(self, result):
+        self.file.write(json.dumps(result, default=str) + '\n')
+        self.file.flush()
+        self.correct[result['id']] = result['correct']
+        self.result_metrics[result['id']] = {key: result[key] for key in EFFICIENCY_METRICS + TOKEN_USAGE_METRICS if key in result} | {"id": result['id'], "correct": result['correct']}
+
+    def summary(self):
+        number_correct = len([x for x in self.correct.values() if x])
+        return Evaluator.totals(number_correct, len(self.correct) - number_correct) | {
+            "efficiency": Evaluator.summarize_efficiency(list(self.result_metrics.values())),
+            "token_usage": Evaluator.summarize_token_usage(list(self.result_metrics.values()))
+        } | self.metadata
+
+    def write_summary(self):
+        self.file.write(json.dumps({"summary": self.summary()}, default=str) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.write_summary()
+        self.file.close()
+
+'''
+Yields the task instance eval results of an evaluation report, either a .json report or a .jsonl report written by JsonlResultsWriter.
+JSON lines reports are streamed in two passes, the first finds the last line of each task instance so that superseded results can be skipped.
+'''
+def iter_results(path):
+    if path.endswith('.jsonl'):
+        last_lines = {}
+        with open(path, 'r') as report_file:
+            for line_number, line in enumerate(report_file):
+                if line.strip() != '' and not line.startswith('{"summary"'):
+                    last_lines[json.loads(line)['id']] = line_number
+
+        latest = set(last_lines.values())
+        with open(path, 'r') as report_file:
+            for line_number, line in enumerate(report_file):
+                if line_number in latest:
+                    yield json.loads(line)
+    else:
+        with open(path, 'r') as report_file:
+            yield from json.load(report_file)['details']
+
+'''
+Loads an evaluation report, either a .json report or a .jsonl report written by JsonlResultsWriter.
+Reports always come back in the format returned by Evaluator.evaluate(), alongside any metadata (eg: shard) recorded in the report.
+'''
+def load_report(path):
+    if path.endswith('.jsonl'):
+        metadata = {}
+        with open(path, 'r') as report_file:
+            for line in report_file:
+                if line.startswith('{"summary"'):
+                    metadata = json.loads(line)['summary']
+
+        report = Evaluator.summarize(list(iter_results(path)))
+        return {key: value for key, value in metadata.items() if key not in report} | report
+
+    with open(path, 'r') as report_file:
+        return json.load(report_file)
+
+
+'''
+Artifact kinds produced by the agents we evaluate, see find_artifacts() and Evaluator.load_artifact().
+'''
+ODOBOT_EXECUTION_EVENTS = 'odobot_execution_events'
+ODOBOT_TASK_QUERY_CONSTRUCTION = 'odobot_task_query_construction'
+WEBVOYAGER_NETWORK_LOG = 'webvoyager_network_log'
+WEBVOYAGER_TOKEN_USAGE = 'webvoyager_token_usage'
+WEBVOYAGER_INTERACT_MESSAGES = 'webvoyager_interact_messages'
+
+'''
+Looks for the artifacts of task executions in the given directories. Yields (kind, path) tuples.
+
+- odobot_execution_events: the folder containing Odobot execution event logs and task query construction results in .json format.
+- wv_network_logs: the directory containing web voyager network logs, and the token files holding the token usage of each task execution.
+- wv_interact_messages: the directory containing folders, named after task instances, that contain interact_messages.json files.
+'''
+def find_artifacts(odobot_execution_events=None, wv_network_logs=None, wv_interact_messages=None):
+
+    if odobot_execution_events:
+        with os.scandir(odobot_execution_events) as _dir:
+            for entry in _dir:
+                if entry.name.endswith('.json') and 'task-query' not in entry.name and 'history' not in entry.name: #If it is a json file, try and parse it as a OdoBotExecutionEventLog
+                    yield ODOBOT_EXECUTION_EVENTS, entry.path
+                # Task query construction results let us automatically evaluate if the bot chose a correct target API/GraphQL endpoint for the task
+                if entry.name.endswith('.json') and 'task-query' in entry.name and 'history' not in entry.name:
+                    yield ODOBOT_TASK_QUERY_CONSTRUCTION, entry.path
+
+    if wv_network_logs:
+        with os.scandir(wv_network_logs) as _dir:
+            for entry in _dir:
+                if entry.name.endswith('.json') and 'token' not in entry.name: # If it is a json file, try and parse it as a WebVoyagerNetworkLog
+                    yield WEBVOYAGER_NETWORK_LOG, entry.path
+                if entry.name.endswith('.json') and 'token' in entry.name:
+                    yield WEBVOYAGER_TOKEN_USAGE, entry.path
+
+    if wv_interact_messages:
+        '''
+        Structure of WebVoyager results. The 'wv_interact_messages' path should point to a directory containing directories with names that include 
+        the task instance id. Each of these directories should contain an 'interact_messages.json' file.
+        '''
+        with os.scandir(wv_interact_messages) as _dir:
+            for entry in _dir:
+                if Task.resolve_instance_id(entry.name) is not None:
+                    path_to_interact_messages = entry.path + '/interact_messages.json'
+
+                    if os.path.exists(path_to_interact_messages) and os.path.isfile(path_to_interact_messages):
+                        yield WEBVOYAGER_INTERACT_MESSAGES, path_to_interact_messages
+
+
 class Evaluator:
 
     def __init__(self):
@@ -581,6 +866,11 @@ class Evaluator:
         self.tasks = []
         self.answer_timezone = 'Canada/Mountain'
         self.odobot_targets = {}
+        self.option_stats = {}
+        self.option_passes = {}
+        self.token_usage = {}
+        self.token_prices = None
+        self.record_evaluation_time = False
         
     def set_answer_timezone(self, tz_identifier):
         self.answer_timezone = tz_identifier
@@ -601,6 +891,99 @@ class Evaluator:
     def register_output(self, instance_id, output):
         self.outputs[instance_id] = output
 
+    def register_token_usage(self, instance_id, prompt_tokens, completion_tokens):
+        self.token_usage[instance_id] = (prompt_tokens, completion_tokens)
+
+    '''
+    Sets the prices used to estimate the cost of task executions, in USD per million prompt and completion tokens.
+    '''
+    def set_token_prices(self, prompt_price, completion_price):
+        self.token_prices = (prompt_price, completion_price)
+
+    '''
+    Records how long each evaluation took in its eval result, as 'evaluation_time'. Off by default, as timings differ from one run to
+    the next and would keep reports of the same task executions from being reproducible.
+    '''
+    def set_record_evaluation_time(self, record_evaluation_time):
+        self.record_evaluation_time = record_evaluation_time
+
+    '''
+    Parses an artifact found by find_artifacts() and registers its contents with the evaluator.
+    Returns the id of the task instance the artifact belongs to, or None if it could not be attributed to a known task instance.
+    '''
+    def load_artifact(self, kind, path):
+        if kind == ODOBOT_EXECUTION_EVENTS:
+            event_log = OdoBotExecutionEventLog.to_execution_event_log(path)
+            if event_log is not None:
+                self.register_network_events(event_log.task_instance, event_log.network_events)
+                return event_log.task_instance
+
+        elif kind == ODOBOT_TASK_QUERY_CONSTRUCTION:
+            task_instance_id = Task.resolve_instance_id(path)
+            if task_instance_id is not None:
+                with open(path, 'r', encoding="utf-8", errors="ignore") as tqc_file:
+                    task_query_construction_result = json.load(tqc_file)
+                    self.register_odobot_target(task_instance_id, task_query_construction_result['targets'][0])
+            return task_instance_id
+
+        elif kind == WEBVOYAGER_NETWORK_LOG:
+            network_log = WebVoyagerNetworkLog.to_network_log(path)
+            if network_log is not None:
+                self.register_network_events(network_log.task_instance, network_log.network_events)
+                return network_log.task_instance
+
+        elif kind == WEBVOYAGER_TOKEN_USAGE:
+            token_usage = WebVoyagerTokenUsage.to_token_usage(path)
+            if token_usage is not None:
+                self.register_token_usage(token_usage.task_instance, token_usage.prompt_tokens, token_usage.completion_tokens)
+                return token_usage.task_instance
+
+        elif kind == WEBVOYAGER_INTERACT_MESSAGES:
+            # The interact_messages.json file sits in a folder named after the task instance.
+            instance = Task.resolve_instance_id(os.path.basename(os.path.dirname(path)))
+            if instance is not None:
+                output_obj = WebVoyagerOutput(open(path, 'r'), instance)
+                self.register_output(output_obj.task_instance, output_obj.output)
+            return instance
+
+        else:
+            raise RuntimeError(f"Unknown artifact kind: {kind}")
+
+        return None
+
+    '''
+    Option stats record, per task id, how many evaluated instances each answer option (by answer id) was the one to pass. The stats loaded
+    at startup decide the order answer options are tried in, see option_order(), so that the historically most likely option is checked first.
+    Stats loaded from a previous run are added to the passes recorded in this run when saving, so they accumulate across runs.
+    '''
+    def load_option_stats(self, path):
+        if os.path.exists(path):
+            with open(path, 'r') as stats_file:
+                self.option_stats = json.load(stats_file)
+            print(f"Loaded answer option stats for {len(self.option_stats)} tasks from {path}")
+
+    def save_option_stats(self, path):
+        option_stats = {task_id: dict(task_stats) for task_id, task_stats in self.option_stats.items()}
+        for instance_id, answer_id in self.option_passes.items():
+            task_stats = option_stats.setdefault(Task.ALL_TASK_INSTANCES[instance_id].parent_task.id, {})
+            task_stats[str(answer_id)] = task_stats.get(str(answer_id), 0) + 1
+
+        with open(path, 'w') as stats_file:
+            json.dump(option_stats, stats_file, indent=4)
+
+    # Records the answer option a task instance passed. Only the latest evaluation of an instance counts, re-evaluating it replaces its pass.
+    def record_option_pass(self, instance, answer_id):
+        if answer_id is not None:
+            self.option_passes[instance.id] = answer_id
+        else:
+            self.option_passes.pop(instance.id, None)
+
+    # Returns the answer option positions of an instance, most frequently passing option first. Ties keep the answer id order.
+    # Only the stats loaded at startup are used, so that the order doesn't depend on the order instances are evaluated in.
+    def option_order(self, instance):
+        task_stats = self.option_stats.get(instance.parent_task.id, {})
+        return sorted(range(len(instance.option_masks)), key=lambda i: -task_stats.get(str(instance.answer_option_ids[i]), 0))
+
     '''
     TODO: This doesn't work because odobot uses normalized paths ie: /dashboard/ignore_stream_item/* which won't exactly match /dashboard/ignore_stream_item/152
     Need to fix this before we can use this to automatically validate targeting
@@ -642,70 +1025,238 @@ class Evaluator:
             self.validate()
 
 
-        number_correct = 0
-        number_incorrect = 0
-        detailed_report = []
+        return Evaluator.summarize(list(self.evaluate_iter()))
 
+    '''
+    Yields the eval result of every task instance with registered network events as soon as it is evaluated, 
+    so callers can stream results out instead of holding the whole report in memory.
+    '''
+    def evaluate_iter(self):
         for instance_id in self.network_events:
-            result = self.evaluate_instance(instance_id, self.network_events[instance_id], self.outputs[instance_id] if instance_id in self.outputs else None)
+            yield self.evaluate_registered_instance(instance_id)
 
-            if result["correct"]:
-                number_correct += 1
-            else:
-                number_incorrect += 1
+    # Information seeking task instances are evaluated against the agent's output, which may land after their network events.
+    def is_awaiting_output(self, instance_id):
+        return instance_id not in self.outputs and Task.ALL_TASK_INSTANCES[instance_id].parent_task.type == 'Information Seeking'
 
-            detailed_report.append(result)
-            
+    # Evaluates a task instance against the network events and output registered for it.
+    def evaluate_registered_instance(self, instance_id):
+        return self.evaluate_instance(instance_id, self.network_events[instance_id], self.outputs[instance_id] if instance_id in self.outputs else None)
+
+    '''
+    Builds an evaluation report from the eval results of individual task instances.
+    '''
+    @staticmethod
+    def summarize(detailed_report):
+        number_correct = len([x for x in detailed_report if x["correct"]])
+        number_incorrect = len(detailed_report) - number_correct
+
+        return Evaluator.totals(number_correct, number_incorrect) | {
+            "efficiency": Evaluator.summarize_efficiency(detailed_report),
+            "token_usage": Evaluator.summarize_token_usage(detailed_report),
+            "details": detailed_report
+        }
+
+    '''
+    Aggregates the per task instance efficiency metrics of side-effect task eval results over a run.
+    '''
+    @staticmethod
+    def summarize_efficiency(detailed_report):
+        side_effect_results = [x for x in detailed_report if "mutating_request_count" in x]
+        passing_results = [x for x in side_effect_results if x["correct"] and x.get("first_satisfied_event_index") is not None]
+
+        def mean(values):
+            return round(sum(values) / len(values), 2) if len(values) > 0 else "N/A"
 
+        return {
+            "mean_network_events": mean([x.get("network_event_count", 0) for x in side_effect_results]),
+            "mean_mutating_requests": mean([x["mutating_request_count"] for x in side_effect_results]),
+            "mean_events_to_completion": mean([x["first_satisfied_event_index"] + 1 for x in passing_results]),
+            "redundant_mutations": sum([x["redundant_mutations"] for x in side_effect_results]),
+            "failed_mutation_attempts": sum([x["failed_mutation_attempts"] for x in side_effect_results])
+        }
+
+    '''
+    Aggregates the token usage and estimated cost of eval results over a run and per task. Cost per success divides the cost of
+    every attempt, passing or not, by the number of passing task instances, as that is what solving a task actually costs.
+    '''
+    @staticmethod
+    def summarize_token_usage(detailed_report):
+        results = [x for x in detailed_report if "total_tokens" in x]
+
+        def usage(results):
+            number_correct = len([x for x in results if x["correct"]])
+            total_tokens = sum([x["total_tokens"] for x in results])
+            summary = {
+                "instances": len(results),
+                "correct": number_correct,
+                "prompt_tokens": sum([x["prompt_tokens"] for x in results]),
+                "completion_tokens": sum([x["completion_tokens"] for x in results]),
+                "total_tokens": total_tokens,
+                "mean_tokens_per_instance": round(total_tokens / len(results), 2) if len(results) > 0 else "N/A",
+                "tokens_per_success": round(total_tokens / number_correct, 2) if number_correct > 0 else "N/A"
+            }
+
+            if len(results) > 0 and all("estimated_cost" in x for x in results):
+                estimated_cost = sum([x["estimated_cost"] for x in results])
+                summary["estimated_cost"] = round(estimated_cost, 6)
+                summary["mean_cost_per_instance"] = round(estimated_cost / len(results), 6)
+                summary["cost_per_success"] = round(estimated_cost / number_correct, 6) if number_correct > 0 else "N/A"
+
+            return summary
+
+        by_task = {}
+        for result in results:
+            instance = Task.ALL_TASK_INSTANCES.get(result["id"])
+            by_task.setdefault(instance.parent_task.id if instance is not None else "Unknown", []).append(result)
+
+        return usage(results) | {
+            "by_task": {task_id: usage(task_results) for task_id, task_results in by_task.items()}
+        }
+
+    @staticmethod
+    def totals(number_correct, number_incorrect):
         return {
             "correct": number_correct,
             "incorrect": number_incorrect,
             "total": number_correct + number_incorrect,
-            "%_correct": round(((number_correct / (number_correct + number_incorrect))*100),2) if (number_correct + number_incorrect) > 0 else "N/A",
-            "details": detailed_report
+            "%_correct": round(((number_correct / (number_correct + number_incorrect))*100),2) if (number_correct + number_incorrect) > 0 else "N/A"
         }
     
-    def evaluate_against_answer(self, instance, instance_reference_answer, network_events):
+    '''
+    Checks every network event against every expected api call of the instance exactly once. 
+    
+    Returns a bitmask of the satisfied expected calls (bit n is set if instance.expected_calls[n] was observed) and a dict 
+    mapping event indices to the matching errors produced by each expected call that event did not match.
 
-        # Side-effect tasks are evaluated by verifying that one or more reference api calls are observable in the network logs of a task. 
-        # Begin by initalizing a dict whose keys are the answers we're looking for and whose values are a boolean flag which is flipped when a match is found.
-        # If all values in this dict are True, the side-effect task was completed successfully.
-        expected_api_invokations = {}
-        for answer in instance_reference_answer:
-            expected_api_invokations[answer] = False
-        
-        mismatch_report = {} # Define a dict for holding additional info about mismatches, useful for analysis/debugging
-        
+    If option_masks are provided, the scan stops as soon as any of them is fully satisfied, as the rest of the log cannot change the verdict.
+    '''
+    def match_expected_calls(self, expected_calls, network_events, option_masks=None):
+        satisfied = 0
+        mismatches = {}
+        efficiency = {
+            "mutating_request_count": 0,
+            "first_satisfied_event_index": None, # Index of the event that completed the task
+            "redundant_mutations": 0, # Mutating requests repeating an already satisfied api call, or made after the task was completed
+            "failed_mutation_attempts": 0 # Mutating requests to an expected endpoint whose request did not satisfy the expected api call
+        }
+
+        last_index = -1
         for index, event in enumerate(network_events):
-            
-            # Go through each provided network event and see if it matches any of the ground truth side-effect answers.
-            for api_call in expected_api_invokations:
+            last_index = index
+            newly_satisfied = False
+            matched = False
+            for position, api_call in enumerate(expected_calls):
                 _match, errors = event.matches(api_call.method, api_call.path, api_call.request_kv)
                 if _match:
-                    expected_api_invokations[api_call] = True
+                    matched = True
+                    newly_satisfied = newly_satisfied or not satisfied & (1 << position)
+                    satisfied |= 1 << position
                 else:
-                    try:
-                        if mismatch_report[index] is None:
-                            mismatch_report[index] = []
-                    except KeyError:
-                        mismatch_report[index] = []
+                    mismatches.setdefault(index, {})[position] = errors
+
+            if event.is_mutating():
+                efficiency["mutating_request_count"] += 1
+                if matched and not newly_satisfied:
+                    efficiency["redundant_mutations"] += 1
+                elif not matched and any(len(event.match_endpoint(api_call.method, api_call.path)) == 0 for api_call in expected_calls):
+                    efficiency["failed_mutation_attempts"] += 1
+
+            if newly_satisfied and option_masks is not None and any(satisfied & mask == mask for mask in option_masks):
+                efficiency["first_satisfied_event_index"] = index
+                break
+
+        # The scan stops once the task is completed, mutating requests made after that point are redundant.
+        for event in network_events[last_index + 1:]:
+            if event.is_mutating():
+                efficiency["mutating_request_count"] += 1
+                efficiency["redundant_mutations"] += 1
+
+        return satisfied, mismatches, efficiency
+
+    # Returns the position of the first answer option (in option_order) fully satisfied by the given satisfied mask, or None if there isn't one.
+    def passing_option(self, instance, satisfied):
+        return next((i for i in self.option_order(instance) if satisfied & instance.option_masks[i] == instance.option_masks[i]), None)
 
-                    mismatch_report[index].append(errors)
+    def verdict(self, instance, satisfied):
+        passing_option = self.passing_option(instance, satisfied)
 
         eval_result = {
             "id": instance.id,
-            "correct": all(list(expected_api_invokations.values()))
+            "correct": passing_option is not None
         }
 
+        if passing_option is not None and instance.answer_options is not None:
+            eval_result["answer_id"] = instance.answer_option_ids[passing_option]
+
+        return eval_result
+
+    '''
+    Opens an EvaluationSession for evaluating a side-effect task instance against a live feed of network events.
+    '''
+    def open_session(self, instance_id):
+        if instance_id not in Task.ALL_TASK_INSTANCES:
+            raise RuntimeError(f"Unknown task instance: {instance_id}")
+
+        instance = Task.ALL_TASK_INSTANCES[instance_id]
+        if instance.parent_task.type != 'Side-effect':
+            raise RuntimeError(f"Only side-effect task instances can be evaluated online, task instance {instance_id} belongs to a(n) '{instance.parent_task.type}' task.")
+
+        return EvaluationSession(self, instance)
+
+    def evaluate_against_answer(self, instance, network_events):
+
+        # Side-effect tasks are evaluated by verifying that one or more reference api calls are observable in the network logs of a task. 
+        # All the unique api calls expected by any of the instance's answer options are looked for in a single scan of the network events.
+        # An answer option is fulfilled when every bit of its mask is set in the satisfied mask, fulfilling any option passes the task.
+        # The options are tried most likely first, so the check for a completed option usually succeeds on its first mask.
+        satisfied, mismatches, efficiency = self.match_expected_calls(instance.expected_calls, network_events, [instance.option_masks[i] for i in self.option_order(instance)])
+
+        eval_result = self.verdict(instance, satisfied) | efficiency
+        self.record_option_pass(instance, eval_result.get("answer_id"))
+
         # If the task is determined not to have been completed successfully, include a mismatch_report for debugging/analysis
         if not eval_result["correct"]:
+            #TODO: maybe one day we should return all the failed options for debugging...
+            # For now report the mismatches against the last failed option.
+            option_mask = instance.option_masks[-1]
+            mismatch_report = {} # Define a dict for holding additional info about mismatches, useful for analysis/debugging
+            for index, event_mismatches in mismatches.items():
+                option_errors = [errors for position, errors in event_mismatches.items() if option_mask & (1 << position)]
+                if len(option_errors) > 0:
+                    mismatch_report[index] = option_errors
+
             eval_result["mismatch_report"] = mismatch_report
 
         return eval_result
 
 
 
+    '''
+    Evaluates a task instance, recording the number of network events considered, the token usage of the execution if known,
+    and, if enabled with set_record_evaluation_time(), how long the evaluation took alongside the eval result.
+    '''
     def evaluate_instance(self, instance_id, network_events, output):
+        start_time = time.perf_counter()
+
+        eval_result = self.evaluate_against_reference(instance_id, network_events, output)
+
+        eval_result["network_event_count"] = len(network_events)
+
+        if instance_id in self.token_usage:
+            prompt_tokens, completion_tokens = self.token_usage[instance_id]
+            eval_result["prompt_tokens"] = prompt_tokens
+            eval_result["completion_tokens"] = completion_tokens
+            eval_result["total_tokens"] = prompt_tokens + completion_tokens
+            if self.token_prices is not None:
+                eval_result["estimated_cost"] = round((prompt_tokens * self.token_prices[0] + completion_tokens * self.token_prices[1]) / 1_000_000, 6)
+
+        if self.record_evaluation_time:
+            eval_result["evaluation_time"] = round(time.perf_counter() - start_time, 6)
+
+        return eval_result
+
+    def evaluate_against_reference(self, instance_id, network_events, output):
         print(f"Evaluating task instance {instance_id}")
 
 
@@ -726,33 +1277,14 @@ class Evaluator:
                 eval_result['target_paths'] = []
                 eval_result['target_kvs'] = []
 
-            if instance_reference.answer_options is not None:
-
-                
-                for answer_option in instance_reference.answer_options:
-                    if instance_reference.id in self.odobot_targets:
-                        eval_result['target_methods'] += [option.method for option in answer_option]
-                        eval_result['target_paths'] += [option.path for option in answer_option]
-                        eval_result['target_kvs'] += [option.request_kv for option in answer_option]
-
-
-                    eval_result = eval_result | self.evaluate_against_answer(instance_reference, answer_option, network_events)
-
-                    if eval_result["correct"] == True:
-                        return eval_result # If one of the options passes evaluation we're done.
-                
-                #TODO: maybe one day we should return all the failed options for debugging...
-                return eval_result # Otherwise return the last failed one. 
+            if instance_reference.id in self.odobot_targets:
+                options = instance_reference.answer_options if instance_reference.answer_options is not None else [instance_reference.answer_key]
+                for answer_option in options:
+                    eval_result['target_methods'] += [answer.method for answer in answer_option]
+                    eval_result['target_paths'] += [answer.path for answer in answer_option]
+                    eval_result['target_kvs'] += [answer.request_kv for answer in answer_option]
 
-            else:
-
-                eval_result = eval_result | self.evaluate_against_answer(instance_reference, instance_reference.answer_key, network_events)
-                if instance_reference.id in self.odobot_targets:
-                    eval_result['target_methods'] += [answer.method for answer in instance_reference.answer_key]
-                    eval_result['target_paths'] += [answer.path for answer in instance_reference.answer_key]
-                    eval_result['target_kvs'] += [answer.request_kv for answer in instance_reference.answer_key]
-                
-                return eval_result
+            return eval_result | self.evaluate_against_answer(instance_reference, network_events)
 
         elif parent_task.type == 'Information Seeking':
             # Information seeking tasks are evaluated by comparing a ground truth answer to the output observed from the agent.
@@ -800,6 +1332,53 @@ class Evaluator:
             raise RuntimeError(f"Unknown task type: {parent_task.type}")
 
 
+'''
+An evaluation session incrementally evaluates a side-effect task instance as network events are pushed to it one by one, for example
+from an agent runner watching a live browser session. The only state kept is a bitmask of the instance's expected api calls satisfied so far,
+so a verdict is available as soon as every expected call of some answer option has been observed, and the agent can be stopped.
 
+Sessions are created with Evaluator.open_session(instance_id).
+'''
+class EvaluationSession:
 
+    def __init__(self, evaluator, instance):
+        self.evaluator = evaluator
+        self.instance = instance
+        self.satisfied = 0
+        self.events_seen = 0
+        self.result = None
+
+    '''
+    Checks a NetworkEvent against the expected api calls not yet satisfied.
+    Returns the passing eval result once the task instance has been completed, None until then.
+    '''
+    def push(self, event):
+        if self.result is not None:
+            return self.result
+
+        self.events_seen += 1
+
+        for position, api_call in enumerate(self.instance.expected_calls):
+            if self.satisfied & (1 << position):
+                continue
+
+            _match, _ = event.matches(api_call.method, api_call.path, api_call.request_kv)
+            if _match:
+                self.satisfied |= 1 << position
+
+        if self.evaluator.passing_option(self.instance, self.satisfied) is not None:
+            self.result = self.evaluator.verdict(self.instance, self.satisfied)
+
+        return self.result
+
+    def is_complete(self):
+        return self.result is not None
+
+    '''
+    Ends the session, returning the eval result for the events pushed so far.
+    '''
+    def close(self):
+        if self.result is None:
+            self.result = self.evaluator.verdict(self.instance, self.satisfied)
 
+        return self.result
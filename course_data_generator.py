@@ -1,13 +1,22 @@
 import yaml
 import argparse
+import bisect
+import fcntl
+import hashlib
+import json
+import math
+import multiprocessing
 import os
 import sys
 import random
 import re
+import sqlite3
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from openai import OpenAI
+from openai import OpenAI, RateLimitError, APIConnectionError, InternalServerError
 
 DATE_FORMAT= "%Y-%m-%d %H:%M:%S"
 
@@ -24,13 +33,33 @@ class Prompter:
 
     INSTRUCTORS = []
 
-    def __init__(self, seed_data):
+    # Element sections generated one element per prompt, and the singular of their name.
+    ELEMENT_SECTIONS = {
+        'assignments': 'assignment',
+        'quizzes': 'quiz',
+        'announcements': 'announcement',
+        'discussions': 'discussion',
+        'groups': 'group',
+        'pages': 'page'
+    }
+
+    # Element sections simple enough to be generated several elements per prompt, see batch_prompt().
+    BATCHABLE_SECTIONS = ['announcements', 'groups', 'pages']
+
+    def __init__(self, seed_data, batch_size=1, batch_sections=None):
         self.seed_course = seed_data['courses'][0]
+        self.batch_size = batch_size
+        self.batch_sections = batch_sections if batch_sections is not None else Prompter.BATCHABLE_SECTIONS
         self.assignments = []
         self.pages = []
         self.entity_names = {}
+        self.element_indexes = {}
         self.set_valid_emails([s['email'] for s in seed_data['students']])
 
+    # The section types of the prompts generate_prompts() returns, see prompt_section().
+    def sections(self):
+        return list(self.seed_course) + [f"{key}_names" for key in self.seed_course if key in Prompter.ELEMENT_SECTIONS and isinstance(self.seed_course[key], list)]
+
     def course_selection_prompt(self, existing_courses):
         return (Prompter.DEFAULT_PROMPT_INSTRUCTIONS, f"Generate the name of a university level course in a random academic field. (Eg:{existing_courses}). Try to generate something thematically distinct from all the given examples. Your output should be the name of the course and nothing else.")
         
@@ -40,8 +69,11 @@ class Prompter:
     def add_entity_names(self, _type, names):
         self.entity_names[_type] = names
 
-    def get_entity_name(self, _type):
-        return self.entity_names[_type].pop()
+    # Names are handed out from the end of the generated list, by element index rather than in the order elements happen to be generated.
+    # This keeps element prompts, and so cached responses, the same from one run to the next.
+    def get_entity_name(self, _type, index):
+        names = self.entity_names[_type]
+        return names[len(names) - 1 - index]
 
     def add_valid_assignment(self, assignment):
         self.assignments.append(assignment)
@@ -49,6 +81,16 @@ class Prompter:
     def add_valid_page(self, page):
         self.pages.append(page)
 
+    '''
+    Returns the position at which to insert the element generated from the seed element at 'index' of the 'key' section.
+    Elements can be generated out of order, this keeps them in the order of the seed course.
+    '''
+    def element_position(self, key, index):
+        indexes = self.element_indexes.setdefault(key, [])
+        position = bisect.bisect(indexes, index)
+        indexes.insert(position, index)
+        return position
+
     def set_valid_emails(self, emails):
         self.emails = emails
 
@@ -86,7 +128,7 @@ Generate new realistic values based on the following snippet in the context of a
         ```
 
         Your output should match the yaml format of the snippet but should replace all [[Page]] and [[Assignment]] markers with valid values, change the names of the modules to reflect the '{course}' course. 
-        """.format(course=self.course, pages=str(self.pages), assignments=str(self.assignments) )
+        """.format(course=self.course, pages=str(sorted(self.pages)), assignments=str(sorted(self.assignments)) )
 
     '''
     Note: sample should be stringified YAML of data.
@@ -137,17 +179,7 @@ Generate new realistic values based on the following snippet in the context of a
         for key in self.seed_course:
             # Assignment, quizzes, announcements and discussions can have relatively complex objects. To minimize generation errors, generate these one object at a time rather than trying to generate the whole section at once.
             # if key in [] and isinstance(self.seed_course[key], list):
-            if key in ['assignments', 'quizzes', 'announcements', 'discussions', 'groups', 'pages'] and isinstance(self.seed_course[key], list):
-
-
-                singular_map = {
-                    'assignments': 'assignment',
-                    'quizzes': 'quiz',
-                    'announcements': 'announcement',
-                    'discussions': 'discussion',
-                    'groups': 'group',
-                    'pages': 'page'
-                }
+            if key in Prompter.ELEMENT_SECTIONS and isinstance(self.seed_course[key], list):
 
                 # Create a prompt to generate unique entity names for these sections
                 seed_names = [ x['title'] if key != 'groups' else x['name'] for x in self.seed_course[key]]
@@ -157,23 +189,15 @@ Generate new realistic values based on the following snippet in the context of a
                 prompts.append(prompt)
 
 
-           
-                for index, element in enumerate(self.seed_course[key]):
-
-                    sample = element
-                    yaml_string = yaml.dump(sample, default_flow_style=False)
-
-                    prompt_inner_text = self.simple_prompt_template(yaml_string, sample, self.course) 
-
-                    if key == 'assignments':
-                        prompt_inner_text = prompt_inner_text + f"\nThe output should describe a(n) {singular_map[key]} called $entity_name$ with the same submission type as that of the example assignment above."
-                    elif key == 'quizzes':
-                        prompt_inner_text = prompt_inner_text + f"\nThe output should describe a(n) {singular_map[key]} called $entity_name$. Do not change the number of questions, answers or their types. Make sure all question_types match with those in the example quiz above."
-                    else:
-                        prompt_inner_text = prompt_inner_text + f"\nThe output should describe a(n) {singular_map[key]} called $entity_name$."
+                indexes = list(range(len(self.seed_course[key])))
 
-                    prompt = (Prompter.DEFAULT_PROMPT_INSTRUCTIONS, prompt_inner_text , sample, key, index) 
-                    prompts.append(prompt)
+                if self.batch_size > 1 and key in self.batch_sections:
+                    # Simpler sections are generated batch_size elements at a time.
+                    for start in range(0, len(indexes), self.batch_size):
+                        prompts.append(self.batch_prompt(key, indexes[start:start + self.batch_size]))
+                else:
+                    for index in indexes:
+                        prompts.append(self.element_prompt(key, index))
             else:
                 sample = {
                     f"{key}": self.seed_course[key]
@@ -202,6 +226,60 @@ Generate new realistic values based on the following snippet in the context of a
         
         return prompts
 
+    '''
+    Returns the prompt generating the element at 'index' of the 'key' section of the seed course.
+    '''
+    def element_prompt(self, key, index):
+        sample = self.seed_course[key][index]
+        yaml_string = yaml.dump(sample, default_flow_style=False)
+
+        prompt_inner_text = self.simple_prompt_template(yaml_string, sample, self.course) 
+
+        if key == 'assignments':
+            prompt_inner_text = prompt_inner_text + f"\nThe output should describe a(n) {Prompter.ELEMENT_SECTIONS[key]} called $entity_name$ with the same submission type as that of the example assignment above."
+        elif key == 'quizzes':
+            prompt_inner_text = prompt_inner_text + f"\nThe output should describe a(n) {Prompter.ELEMENT_SECTIONS[key]} called $entity_name$. Do not change the number of questions, answers or their types. Make sure all question_types match with those in the example quiz above."
+        else:
+            prompt_inner_text = prompt_inner_text + f"\nThe output should describe a(n) {Prompter.ELEMENT_SECTIONS[key]} called $entity_name$."
+
+        return (Prompter.DEFAULT_PROMPT_INSTRUCTIONS, prompt_inner_text , sample, key, index) 
+
+    '''
+    Returns the prompt generating the elements at 'indexes' of the 'key' section of the seed course in a single request, as a list.
+    Batch prompts hold the list of samples and the list of indexes where element prompts hold a single sample and index. A batch of one element is an element prompt.
+    '''
+    def batch_prompt(self, key, indexes):
+        if len(indexes) == 1:
+            return self.element_prompt(key, indexes[0])
+
+        sample = [self.seed_course[key][index] for index in indexes]
+        yaml_string = yaml.dump(sample, default_flow_style=False)
+
+        prompt_inner_text = self.simple_prompt_template(yaml_string, sample, self.course)
+        prompt_inner_text = prompt_inner_text + f"\nThe output should be a list of {len(indexes)} {key}, each describing a(n) {Prompter.ELEMENT_SECTIONS[key]} based on the element of the snippet at the same position. In order, they should be called $entity_name$."
+
+        return (Prompter.DEFAULT_PROMPT_INSTRUCTIONS, prompt_inner_text, sample, key, indexes)
+
+    '''
+    Returns, for each prompt, the set of indexes of the prompts that must complete before it can run.
+    Element prompts pop their $entity_name$ from the names generated by the names prompt of their section,
+    and the modules prompt lists the pages and assignments generated by the page and assignment prompts.
+    Every other prompt is independent.
+    '''
+    def prompt_dependencies(self, prompts):
+        names_prompts = {prompt[3]: index for index, prompt in enumerate(prompts) if len(prompt) == 4 and prompt[3].endswith('_names')}
+
+        dependencies = []
+        for prompt in prompts:
+            if len(prompt) > 4 and prompt[3] + '_names' in names_prompts:
+                dependencies.append({names_prompts[prompt[3] + '_names']})
+            elif len(prompt) == 3 and 'modules' in prompt[2]:
+                dependencies.append({index for index, _prompt in enumerate(prompts) if len(_prompt) > 4 and _prompt[3] in ['pages', 'assignments']})
+            else:
+                dependencies.append(set())
+
+        return dependencies
+
     
 
 
@@ -217,6 +295,41 @@ class Validator:
 
         return self.does_structure_match(reference_yaml, generated_yaml)
     
+    '''
+    Checks the complete lines of a streamed output, see LLM.partial_yaml(), for problems that the rest of the output can no longer fix:
+    yaml that fails to parse before its last line, a top level of the wrong type, or a finished top-level value of one of the reference's keys
+    that should have been an object or a list. Keys the reference doesn't have are skipped, as validation removes them. Returns the errors found, if any.
+    '''
+    def partial_structure_errors(self, partial_yaml, reference):
+        if partial_yaml is None:
+            return []
+
+        try:
+            partial = yaml.safe_load(partial_yaml)
+        except yaml.MarkedYAMLError as e:
+            # Errors on the last line may only be due to the output being cut short there.
+            if e.problem_mark is not None and e.problem_mark.line < partial_yaml.count('\n') - 1:
+                return ["Output failed to parse as yaml!"]
+            return []
+
+        if partial is None:
+            return []
+
+        if isinstance(reference, dict) != isinstance(partial, dict) or isinstance(reference, list) != isinstance(partial, list):
+            return [f"Expected {'an object' if isinstance(reference, dict) else 'a list'} matching the snippet, but the output is a {type(partial).__name__}."]
+
+        if not isinstance(reference, dict):
+            return []
+
+        keys = list(partial.keys())
+
+        # The last key may still be receiving its value.
+        for key in keys[:-1]:
+            if key in reference and partial[key] is not None and isinstance(reference[key], (dict, list)) and not isinstance(partial[key], type(reference[key])):
+                return [f"Expected {'an object' if isinstance(reference[key], dict) else 'a list'} for '{key}', but got {type(partial[key]).__name__}: {partial[key]}"]
+
+        return []
+
     def does_structure_match(self, reference, sample, errors=None, list_key=None):
         if errors == None:
             errors = []
@@ -387,21 +500,318 @@ class Validator:
         
 
 
+'''
+Retry controller for LLM calls and generated sections.
+
+Transient API failures (rate limits, connection errors, server errors) are retried with bounded exponential backoff and full jitter,
+honouring any Retry-After header. Sections failing to parse or validate are retried right away, from the original prompt plus the
+output and errors of the previous attempt only, capped so that retry prompts do not grow from one attempt to the next.
+'''
+class RetryPolicy:
+
+    def __init__(self, max_retries=5, base_delay=1.0, max_delay=60.0, max_context_chars=4000, max_context_errors=10):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_context_chars = max_context_chars
+        self.max_context_errors = max_context_errors
+
+    def delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+    def retry_prompt(self, prompt, errors, previous_output):
+        retry_text = f"{prompt[1]}\n"
+
+        if previous_output is not None:
+            if len(previous_output) > self.max_context_chars:
+                previous_output = previous_output[:self.max_context_chars] + "\n[...]"
+            retry_text += f"In a previous attempt you've generated the following incorrect output:\n\n{previous_output}"
+            retry_text += f"\n\nThe output above has the following errors:\n"
+        else:
+            retry_text += f"Avoid the following errors when generating output:\n"
+
+        for e_index,error in enumerate(errors[:self.max_context_errors]):
+            retry_text += f"[Error {e_index+1}] {error}\n"
+        if len(errors) > self.max_context_errors:
+            retry_text += f"...and {len(errors) - self.max_context_errors} more errors.\n"
+
+        retry_text += f"\nTry again by fixing these errors."
+
+        return (prompt[0], retry_text) + prompt[2:]
+
+
+'''
+Speculative generation of the section types that often fail validation, eg: quizzes. Rather than retrying them one attempt after the other,
+several candidates are requested concurrently until one passes validation, keeping the lowest numbered candidate among those that passed. The number of candidates adapts to the failure rate
+of the section type observed so far in telemetry: just enough for at least one of them to pass with probability 'target', up to max_candidates.
+'''
+class SpeculationPolicy:
+
+    def __init__(self, sections=None, max_candidates=3, target=0.9):
+        self.sections = sections if sections is not None else []
+        self.max_candidates = max_candidates
+        self.target = target
+
+    def candidates(self, section, telemetry):
+        if section not in self.sections or self.max_candidates <= 1:
+            return 1
+
+        failed_attempts, attempts = telemetry.attempt_outcomes(section)
+        # Smoothed, so section types without attempts yet start at a failure rate of 1/2.
+        failure_rate = (failed_attempts + 1) / (attempts + 2)
+
+        return max(1, min(self.max_candidates, math.ceil(math.log(1 - self.target) / math.log(failure_rate))))
+
+
+'''
+Token bucket shared by every thread making LLM calls, so that requests stay within the requests and tokens per minute of our OpenAI tier
+instead of running into 429s. A limit of None is unlimited.
+'''
+class TokenBucket:
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = requests_per_minute if requests_per_minute is not None else 0
+        self.tokens = tokens_per_minute if tokens_per_minute is not None else 0
+        self.updated_at = time.monotonic()
+        self.condition = threading.Condition()
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed_minutes = (now - self.updated_at) / 60
+        self.updated_at = now
+
+        if self.requests_per_minute is not None:
+            self.requests = min(self.requests_per_minute, self.requests + elapsed_minutes * self.requests_per_minute)
+        if self.tokens_per_minute is not None:
+            self.tokens = min(self.tokens_per_minute, self.tokens + elapsed_minutes * self.tokens_per_minute)
+
+    # Blocks until a request of the estimated number of tokens fits within the limits, then takes it out of the bucket.
+    def acquire(self, tokens):
+        with self.condition:
+            while True:
+                self.refill()
+
+                # A single request larger than the whole bucket would wait forever, let it through once the bucket is full.
+                needed_tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute is not None else 0
+
+                wait_minutes = 0
+                if self.requests_per_minute is not None and self.requests < 1:
+                    wait_minutes = max(wait_minutes, (1 - self.requests) / self.requests_per_minute)
+                if self.tokens_per_minute is not None and self.tokens < needed_tokens:
+                    wait_minutes = max(wait_minutes, (needed_tokens - self.tokens) / self.tokens_per_minute)
+
+                if wait_minutes == 0:
+                    if self.requests_per_minute is not None:
+                        self.requests -= 1
+                    if self.tokens_per_minute is not None:
+                        self.tokens -= tokens
+                    return
+
+                self.condition.wait(wait_minutes * 60)
+
+    # Settles the difference between the estimated and the actual number of tokens of a request once it is known.
+    def consume(self, tokens):
+        if self.tokens_per_minute is not None:
+            with self.condition:
+                self.tokens -= tokens
+
+
+'''
+Raised when a streamed response is aborted because its output can no longer pass validation, see LLM.execute_prompt().
+Holds the output received before the abort and the errors that caused it.
+'''
+class StreamAborted(Exception):
+
+    def __init__(self, output, errors):
+        super().__init__(f"Streamed response aborted: {errors}")
+        self.output = output
+        self.errors = errors
+
+
+'''
+Raised when a course can't be generated: a prompt fails in a way retries can't fix, or the course keeps coming out incomplete.
+Worker processes hand it back to the main process as a failed result, see generate_course_in_worker().
+'''
+class GenerationFailed(Exception):
+    pass
+
+
+'''
+Raised when a prompt has no cached response in the 'ro' cache mode, see LLM.execute_prompt(). Replays never call the OpenAI API.
+'''
+class CacheMiss(Exception):
+    pass
+
+
 class LLM:
 
-    def __init__(self, api_key, model):
-        self.client = OpenAI(api_key=api_key)
+    '''
+    Cache modes, see execute_prompt().
+    - rw: serve responses from the cache, and record new responses in it.
+    - ro: serve responses from the cache only, prompts missing from it raise CacheMiss. Useful to replay a previous run without changing its cache or calling the API.
+    - off: bypass the cache.
+    '''
+    CACHE_MODES = ['rw', 'ro', 'off']
+
+    def __init__(self, api_key, model, cache_dir=None, cache_mode='rw', base_url=None, retry_policy=None, token_bucket=None, stream=False):
+        # Retries are handled by the retry policy, rather than by the OpenAI client.
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
         self.model = model
+        self.stream = stream
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.token_bucket = token_bucket if token_bucket is not None else TokenBucket()
+        self.cache_dir = cache_dir
+        self.cache_mode = cache_mode if cache_dir is not None else 'off'
+
+        if self.cache_mode != 'off':
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # Responses are cached by model, instructions and input. Identical prompts get identical responses, which makes reruns replay previous runs.
+    def cache_key(self, instructions, input):
+        key = [self.model, instructions, input]
+        return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
 
-    def execute_prompt(self, prompt):
-        response = self.client.responses.create(
+    '''
+    If a 'usage' dict is given, the input and output tokens billed for the prompt are added to it, along with the number of API requests made.
+    Responses served from the cache are not billed.
+
+    When streaming, check(output) is called with the output received so far every time a new line of it arrives. If it returns errors,
+    the response is aborted and StreamAborted is raised, so that bad outputs cost neither the rest of their output tokens nor their latency.
+    '''
+    def execute_prompt(self, prompt, usage=None, check=None):
+        instructions = prompt[0] if isinstance(prompt, tuple) else ""
+        input = prompt[1] if isinstance(prompt, tuple) else prompt
+
+        if self.cache_mode != 'off':
+            path = self.cache_path(self.cache_key(instructions, input))
+            if os.path.exists(path):
+                with open(path, 'r') as cache_file:
+                    if usage is not None:
+                        usage['cache_hits'] = usage.get('cache_hits', 0) + 1
+                    return json.load(cache_file)['output_text']
+
+            if self.cache_mode == 'ro':
+                raise CacheMiss(f"No cached response for prompt in read-only cache mode ({path}): {input[:200]}")
+
+        # Roughly 4 characters per token, output tokens are settled once the response comes back.
+        estimated_tokens = (len(instructions) + len(input)) // 4
+
+        for attempt in range(self.retry_policy.max_retries + 1):
+            self.token_bucket.acquire(estimated_tokens)
+            if usage is not None:
+                usage['requests'] = usage.get('requests', 0) + 1
+            try:
+                if self.stream:
+                    output_text, response_usage = self.stream_response(instructions, input, estimated_tokens, usage, check)
+                else:
+                    response = self.client.responses.create(
+                        model=self.model,
+                        instructions=instructions,
+                        input=input
+                    )
+                    output_text, response_usage = response.output_text, response.usage
+                break
+            except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                if attempt >= self.retry_policy.max_retries:
+                    raise
+
+                retry_after = None
+                if getattr(e, 'response', None) is not None:
+                    try:
+                        retry_after = float(e.response.headers.get('retry-after'))
+                    except (TypeError, ValueError):
+                        pass
+
+                delay = self.retry_policy.delay(attempt, retry_after)
+                print(f"OpenAI request failed ({type(e).__name__}), retrying in {round(delay, 2)}s.")
+                time.sleep(delay)
+
+        if response_usage is not None:
+            self.token_bucket.consume(response_usage.total_tokens - estimated_tokens)
+            if usage is not None:
+                usage['input_tokens'] = usage.get('input_tokens', 0) + response_usage.input_tokens
+                usage['output_tokens'] = usage.get('output_tokens', 0) + response_usage.output_tokens
+
+        if self.cache_mode == 'rw':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so that concurrent readers and crashes never see a partial cache entry.
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w') as cache_file:
+                json.dump({
+                    "model": self.model,
+                    "instructions": instructions,
+                    "input": input,
+                    "output_text": output_text
+                }, cache_file)
+            os.replace(temp_path, path)
+
+        return output_text
+
+    '''
+    Streams a response, returning its output and usage once it completes. Aborted responses report no usage, so their tokens are estimated
+    at about 4 characters per token and billed to 'usage' before StreamAborted is raised.
+    '''
+    def stream_response(self, instructions, input, estimated_tokens, usage, check):
+        stream = self.client.responses.create(
             model=self.model,
-            instructions=prompt[0] if isinstance(prompt, tuple) else "",
-            input=prompt[1] if isinstance(prompt, tuple) else prompt
+            instructions=instructions,
+            input=input,
+            stream=True
         )
 
-        return response.output_text
+        output_text = ""
+        checked_lines = 0
+        try:
+            for event in stream:
+                if event.type == 'response.output_text.delta':
+                    output_text += event.delta
+
+                    if check is None or output_text.count('\n') == checked_lines:
+                        continue
+                    checked_lines = output_text.count('\n')
+
+                    errors = check(output_text)
+                    if len(errors) > 0:
+                        output_tokens = len(output_text) // 4
+                        self.token_bucket.consume(output_tokens)
+                        if usage is not None:
+                            usage['input_tokens'] = usage.get('input_tokens', 0) + estimated_tokens
+                            usage['output_tokens'] = usage.get('output_tokens', 0) + output_tokens
+                        raise StreamAborted(output_text, errors)
+
+                elif event.type == 'response.completed':
+                    return event.response.output_text, event.response.usage
+
+                elif event.type in ['response.failed', 'response.incomplete', 'error']:
+                    raise RuntimeError(f"Streamed response ended with {event.type}: {event}")
+        finally:
+            # Closing the stream drops the connection, which stops the generation of an aborted response.
+            stream.close()
+
+        raise RuntimeError("Streamed response ended before completing.")
     
+    '''
+    Returns the complete lines of the yaml received so far in a streamed output, or None if there is no yaml code block yet.
+    Incomplete lines are left out, as the rest of their values may still be on their way. Output outside of a code block is never checked,
+    as prose like 'Note: ...' can't be told apart from yaml until the output completes.
+    '''
+    def partial_yaml(self, output):
+        if '```yaml' not in output:
+            return None
+        output = output.split('```yaml', 1)[1].split('```', 1)[0]
+
+        if '\n' not in output:
+            return None
+        return output[:output.rindex('\n') + 1]
+
     # Extracts the yaml data from text output and returns a parsed yaml entity.
     def extract_yaml(self, output):
         # Handle the case where the yaml is enclosed in a markdown code block.
@@ -417,6 +827,131 @@ class LLM:
 
 
 
+# Appends a line to a file that other generation processes may be appending to as well, holding an exclusive lock so lines never interleave.
+def append_line(file, line):
+    fcntl.flock(file, fcntl.LOCK_EX)
+    try:
+        file.write(line)
+        file.flush()
+    finally:
+        fcntl.flock(file, fcntl.LOCK_UN)
+
+'''
+Per prompt telemetry. Every prompt produces one record: the course, section type and element index it generated, how many attempts
+it took, its latency, the tokens billed for it and the validation errors, parse failures and aborted streams met along the way.
+Records are appended to a JSONL file as they are produced, and summarized at the end of the run.
+'''
+class Telemetry:
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self.lock = threading.Lock()
+        self.file = open(path, 'a') if path is not None else None
+
+    # Called in worker processes, which record their own telemetry and hand their records back to the main process.
+    # Every write is flushed, so closing the handle inherited from the main process or from the previous course loses nothing.
+    def reopen(self):
+        if self.file is not None:
+            self.file.close()
+        self.records = []
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'a') if self.path is not None else None
+
+    def record(self, record):
+        with self.lock:
+            self.records.append(record)
+            if self.file is not None:
+                append_line(self.file, json.dumps(record) + '\n')
+
+    # Returns the number of failed attempts and of attempts at generating a section type so far. Only the last attempt of a prompt can pass.
+    def attempt_outcomes(self, section):
+        with self.lock:
+            records = [x for x in self.records if x['section'] == section]
+        return sum([x['attempts'] for x in records]) - len([x for x in records if x['passed']]), sum([x['attempts'] for x in records])
+
+    @staticmethod
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    def summary(self, number_of_hotspots=10):
+        by_section = {}
+        by_course = {}
+        for record in self.records:
+            by_section.setdefault(record['section'], []).append(record)
+            course = by_course.setdefault(record['course'], {"input_tokens": 0, "output_tokens": 0, "requests": 0, "prompts": 0})
+            course['input_tokens'] += record['input_tokens']
+            course['output_tokens'] += record['output_tokens']
+            course['requests'] += record['requests']
+            course['prompts'] += 1
+
+        sections = {}
+        for section, records in by_section.items():
+            latencies = [x['latency'] for x in records]
+            sections[section] = {
+                "prompts": len(records),
+                "p50_latency": round(Telemetry.percentile(latencies, 50), 3),
+                "p95_latency": round(Telemetry.percentile(latencies, 95), 3),
+                "input_tokens": sum([x['input_tokens'] for x in records]),
+                "output_tokens": sum([x['output_tokens'] for x in records]),
+                "retries": sum([x['attempts'] - 1 for x in records]),
+                "validation_errors": sum([x['validation_errors'] for x in records]),
+                "parse_failures": sum([x['parse_failures'] for x in records]),
+                "stream_aborts": sum([x['stream_aborts'] for x in records]),
+                "failed": len([x for x in records if not x['passed']])
+            }
+
+        hotspots = sorted([x for x in self.records if x['attempts'] > 1 or not x['passed']], key=lambda x: (-x['attempts'], x['passed']))[:number_of_hotspots]
+
+        return {
+            "sections": sections,
+            "courses": by_course,
+            "retry_hotspots": [{key: x[key] for key in ['course', 'section', 'index', 'attempts', 'validation_errors', 'parse_failures', 'stream_aborts', 'passed']} for x in hotspots]
+        }
+
+    def close(self):
+        summary = self.summary()
+        if self.file is not None:
+            self.file.write(json.dumps({"summary": summary}) + '\n')
+            self.file.close()
+        return summary
+
+
+'''
+Returns the section type a prompt generates, eg: 'quizzes' for a quiz, 'quizzes_names' for quiz names or 'instructor'.
+'''
+def prompt_section(prompt):
+    if len(prompt) > 3:
+        return prompt[3]
+    return ', '.join(prompt[2].keys()) if isinstance(prompt[2], dict) else str(prompt[2])
+
+'''
+Batch prompts generate several elements of a section in one request, see Prompter.batch_prompt().
+'''
+def is_batch_prompt(prompt):
+    return len(prompt) > 4 and isinstance(prompt[4], list)
+
+# Returns the seed course indexes of the elements a prompt generates, [None] for whole sections and names.
+def prompt_indexes(prompt):
+    if is_batch_prompt(prompt):
+        return prompt[4]
+    return [prompt[4] if len(prompt) > 4 else None]
+
+def print_telemetry_summary(summary):
+    print(f"{'SECTION':<25} | {'PROMPTS':>7} | {'P50 (s)':>8} | {'P95 (s)':>8} | {'IN TOKENS':>10} | {'OUT TOKENS':>10} | {'RETRIES':>7} | {'FAILED':>6}")
+    for section, stats in sorted(summary['sections'].items(), key=lambda item: -item[1]['p95_latency']):
+        print(f"{section:<25} | {stats['prompts']:>7} | {stats['p50_latency']:>8} | {stats['p95_latency']:>8} | {stats['input_tokens']:>10} | {stats['output_tokens']:>10} | {stats['retries']:>7} | {stats['failed']:>6}")
+
+    for course, stats in summary['courses'].items():
+        print(f"Course '{course}': {stats['input_tokens']} input tokens, {stats['output_tokens']} output tokens over {stats['requests']} requests for {stats['prompts']} prompts.")
+
+    if len(summary['retry_hotspots']) > 0:
+        print(f"Retry hot spots:")
+        for hotspot in summary['retry_hotspots']:
+            print(f"  {hotspot['section']}" + (f"[{hotspot['index']}]" if hotspot['index'] is not None else "") + f" of '{hotspot['course']}': {hotspot['attempts']} attempts, {hotspot['validation_errors']} validation errors, {hotspot['parse_failures']} parse failures, {hotspot['stream_aborts']} aborted streams" + ("" if hotspot['passed'] else ", failed"))
+
+
 # https://stackoverflow.com/questions/11540854/file-as-command-line-argument-for-argparse-error-message-if-argument-is-not-va
 def is_valid_file(parser, arg):
     if not os.path.exists(arg):
@@ -424,186 +959,620 @@ def is_valid_file(parser, arg):
     else:
         return open(arg, 'r')
 
-def generate_section(llm, prompter, validator, index, prompt, generated_course, retries, errors=None, previous_output=None):
+# Guards the generated course and the generation state shared by sections generated concurrently.
+generation_lock = threading.Lock()
+
+'''
+Runs prompts on a thread pool of 'concurrency' workers, each prompt starting as soon as the prompts it depends on have completed.
+run(index, prompt) is called for every prompt not in 'completed', failures are raised once the prompts already running have completed.
+'''
+def run_prompts(prompts, dependencies, run, concurrency, completed=None):
+    completed = completed if completed is not None else set()
+    remaining = [set(x) - completed for x in dependencies]
+    dependents = [[] for _ in prompts]
+    for index, _dependencies in enumerate(dependencies):
+        for dependency in _dependencies:
+            dependents[dependency].append(index)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    running = {}
+
+    try:
+        for index, prompt in enumerate(prompts):
+            if index not in completed and len(remaining[index]) == 0:
+                running[executor.submit(run, index, prompt)] = index
+
+        while len(running) > 0:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                future.result()
+
+                for dependent in dependents[index]:
+                    remaining[dependent].discard(index)
+                    if len(remaining[dependent]) == 0:
+                        running[executor.submit(run, dependent, prompts[dependent])] = dependent
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+'''
+Adds a validated section to the generated course and to the generation state.
+- key: the seed course key of the element or names the section holds (prompt[3]), None for whole sections.
+- index: the index of the element in the seed course (prompt[4]), None for whole sections and names.
+'''
+def store_section(prompter, generated_course, key, index, generated_yaml):
+    # Sections generated concurrently share the generated course and the generation state.
+    with generation_lock:
+        # Capture the generated main user so we can avoid duplicating them over the course of the generation session.
+        if 'main_user' in generated_yaml:
+            Prompter.MAIN_USERS.append(generated_yaml['main_user'])
+            print(f"MAIN_USERS: {Prompter.MAIN_USERS}")
+        # Capture the generated instructors so we can avoid duplicating them over the course of the generation session. 
+        if 'instructor' in generated_yaml:
+            Prompter.INSTRUCTORS.append(generated_yaml['instructor'])
+            print(f"INSTRUCTORS: {Prompter.INSTRUCTORS}")
+
+
+        # updated our generated course dict with the new data.
+
+        if key is not None: # If the prompt contains a key and index because the generated result is an item in the 'assignments', 'discussions', 'announcements', or 'quizzes' section. 
+            # key should be the key name from the reference course containing the complex objects which needed to be generated one at a time.
+            if key == 'assignments': # Still need to capture generated assignment values
+                prompter.add_valid_assignment(generated_yaml['title'])
+
+            if key == 'pages': # Still need to capture generated page values.
+                prompter.add_valid_page(generated_yaml['title'])
+
+            if "_names"  in key: # If the purpose of the prompt was just to generate some names, update the prompter with those names and move on.
+                prompter.add_entity_names(key.split('_')[0], generated_yaml)
+                return
+
+            if key not in generated_course:
+                generated_course[key] = []
+
+
+            generated_course[key].insert(prompter.element_position(key, index), generated_yaml) # Insert the generated item at a matching index in the generated course object.
+            print(f"Inserted generated output into '{key}' of the generated_course. Generated course currently has {len(generated_course[key])} {key}.")
+        else:
+            # Handle 'normal' section.
+            generated_course.update(generated_yaml)
+
+'''
+Checkpoint journal. Every validated section is appended to the journal as it is produced, as is the start and the completion of every
+course, so that a run can be resumed with --resume rather than started over. Sections are journaled as YAML, so they come back exactly as generated.
+A run started without --resume moves an existing journal aside rather than overwriting it, so that the run it checkpoints can still be resumed.
+'''
+class Journal:
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+
+        if not resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            moved_path = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}"
+            os.replace(path, moved_path)
+            print(f"Journal {path} already exists and --resume was not given, moved it to {moved_path}")
+
+        self.entries = Journal.load(path) if resume else []
+        self.file = open(path, 'a' if resume else 'w')
+
+        # Start on a new line if the journal ends with an entry cut short by a crash.
+        if resume and self.file.tell() > 0:
+            with open(path, 'rb') as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                if journal_file.read(1) != b'\n':
+                    self.file.write('\n')
+
+    @staticmethod
+    def load(path):
+        entries = []
+        if os.path.exists(path):
+            with open(path, 'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # The last entry may have been cut short by a crash.
+                        print(f"Skipping incomplete journal entry: {line}")
+        return entries
+
+    # Called in worker processes, so that they append to the journal through their own file handle.
+    def reopen(self):
+        self.file.close()
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'a')
+
+    def write(self, entry):
+        with self.lock:
+            append_line(self.file, json.dumps(entry) + '\n')
+
+    def close(self):
+        self.file.close()
+
+    # Returns the completed courses by course number. Courses generated by worker processes complete in any order.
+    def completed_courses(self):
+        return {x['course_number']: yaml.safe_load(x['yaml']) for x in self.entries if x['type'] == 'course_done'}
+
+    '''
+    Returns the name and journaled sections of the latest attempt at generating a course, or None if the course was never started or is complete.
+    '''
+    def course_in_progress(self, course_number):
+        course = None
+        for entry in self.entries:
+            if entry['course_number'] != course_number:
+                continue
+
+            if entry['type'] == 'course_start':
+                course = {"course": entry['course'], "sections": []}
+            elif entry['type'] == 'section' and course is not None:
+                course['sections'].append(entry)
+            elif entry['type'] == 'course_done':
+                course = None
+
+        return course
+
+
+'''
+Uniqueness registry shared by every process generating courses, backed by SQLite. Main users and instructors are reserved by name and email,
+and course names by name, so courses generated in parallel never duplicate each other. A reservation fails if any of its values is taken.
+'''
+class UniquenessRegistry:
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS people (
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL,
+        UNIQUE (kind, name),
+        UNIQUE (kind, email)
+    );
+    CREATE TABLE IF NOT EXISTS courses (
+        name TEXT PRIMARY KEY
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connect()
+
+    # SQLite connections cannot be shared across processes, each process connects on its own. Threads of a process share its connection.
+    def connect(self):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.connection.executescript(UniquenessRegistry.SCHEMA)
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM people")
+            self.connection.execute("DELETE FROM courses")
+
+    def reserve_person(self, kind, person):
+        try:
+            with self.lock, self.connection:
+                self.connection.execute("INSERT INTO people (kind, name, email) VALUES (?, ?, ?)", (kind, person['name'], person['email']))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def reserve_course(self, name):
+        try:
+            with self.lock, self.connection:
+                self.connection.execute("INSERT INTO courses (name) VALUES (?)", (name,))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def people(self, kind):
+        with self.lock:
+            return [{"name": name, "email": email} for name, email in self.connection.execute("SELECT name, email FROM people WHERE kind = ? ORDER BY rowid", (kind,))]
+
+    def courses(self):
+        with self.lock:
+            return [x[0] for x in self.connection.execute("SELECT name FROM courses ORDER BY rowid")]
+
+    '''
+    Reserves the main user and instructor of a validated section, if it holds any. Returns validation errors for those already taken.
+    '''
+    def reserve_section(self, generated_yaml):
+        errors = []
+        for kind in ['main_user', 'instructor']:
+            if kind in generated_yaml and not self.reserve_person(kind, generated_yaml[kind]):
+                errors.append(f"The generated {kind} {generated_yaml[kind]} already exists!")
+        return errors
+
+'''
+Requests one candidate output for a section, and validates it against the reference sample. Speculative candidates still streaming are
+aborted once 'cancelled' is set. Returns the outcome of the candidate:
+- status: 'passed', 'invalid' (failed validation), 'unparsable' (failed to parse as yaml) or 'aborted' (streamed output aborted).
+- candidate: the number of the candidate, the lowest numbered of the candidates that passed is kept.
+- yaml: the generated yaml, cleaned by validation, for 'passed' and 'invalid' candidates.
+- errors: the errors to retry from.
+- output: the output to retry from.
+- usage: the requests, cache hits and tokens of the candidate, see LLM.execute_prompt().
+'''
+def generate_candidate(llm, validator, index, prompt, reference, candidate, cancelled=None):
+    usage = {}
+    label = f"{index}" + (f"/{candidate}" if candidate > 0 or cancelled is not None else "")
+
+    def check(output):
+        if cancelled is not None and cancelled.is_set():
+            return ["Another candidate passed validation first."]
+        return validator.partial_structure_errors(llm.partial_yaml(output), reference)
+
+    try:
+        generated_output = llm.execute_prompt(prompt, usage, check)
+    except StreamAborted as e:
+        print(f"Aborted streamed output[{label}]: {e.errors}\n{e.output}\n")
+        return {"status": "aborted", "candidate": candidate, "yaml": None, "errors": e.errors, "output": e.output, "usage": usage}
+
+    print(f"Output[{label}]: {generated_output}\n")
+
+    try:
+        generated_yaml = llm.extract_yaml(generated_output)
+    except (yaml.scanner.ScannerError, yaml.parser.ParserError):
+        return {"status": "unparsable", "candidate": candidate, "yaml": None, "errors": ["Output failed to parse as yaml!"], "output": generated_output, "usage": usage}
+
+    original_generated_yaml_string = yaml.dump(generated_yaml, default_flow_style=False)
+
+    try:
+        validation_result, errors = validator.validate(generated_yaml, reference)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        # Validation cleans the output in place, and gives up on outputs too far from the structure it expects.
+        validation_result, errors = False, [f"Output does not match the structure of the snippet ({type(e).__name__}: {e})."]
+
+    validated_generated_yaml_string = yaml.dump(generated_yaml, default_flow_style=False)
+
+    if original_generated_yaml_string != validated_generated_yaml_string:
+        print(f"Cleaning happened during validation!")
+        print(f"Original Generated Output:\n{original_generated_yaml_string}\nAfter Validation:\n{validated_generated_yaml_string}")
+
+    return {"status": "passed" if validation_result else "invalid", "candidate": candidate, "yaml": generated_yaml, "errors": errors, "output": validated_generated_yaml_string, "usage": usage}
+
+'''
+Runs generate(candidate, cancelled) for 'candidates' candidates concurrently, and returns the outcomes of those completed by the time
+the first one passes, or of all of them if none pass. The others are cancelled: streamed candidates are aborted, and requests that can't be
+aborted are left to complete in the background. Their tokens are billed, but not counted in telemetry.
+'''
+def speculate(candidates, generate):
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=candidates)
+    running = {executor.submit(generate, candidate, cancelled) for candidate in range(candidates)}
+    outcomes = []
+
+    try:
+        while len(running) > 0:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            outcomes.extend([future.result() for future in done])
+            if any([x['status'] == 'passed' for x in outcomes]):
+                break
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return outcomes
+
+def generate_section(llm, prompter, validator, index, prompt, generated_course, retry_policy, telemetry, checkpoint):
     print(f"Length of prompt at start of generate_section(): {len(prompt)}")
+
+    start_time = time.time()
+    usage = {}
+    record = {
+        "course": prompter.course,
+        "section": prompt_section(prompt),
+        "index": prompt[4] if len(prompt) > 4 else None,
+        "attempts": 0,
+        "validation_errors": 0,
+        "parse_failures": 0,
+        "stream_aborts": 0,
+        "passed": False
+    }
+
+    def record_telemetry(passed):
+        record['passed'] = passed
+        record['latency'] = round(time.time() - start_time, 3)
+        record['requests'] = usage.get('requests', 0)
+        record['cache_hits'] = usage.get('cache_hits', 0)
+        record['input_tokens'] = usage.get('input_tokens', 0)
+        record['output_tokens'] = usage.get('output_tokens', 0)
+        telemetry.record(record)
+        return passed
+
     try:
 
         if '$emails$' in prompt[1]:
             # Update the prompt
-            if len(prompt) > 3:
-                prompt = (prompt[0], prompter.insert_emails_into_prompt(prompt[1]), prompt[2], prompt[3], prompt[4])
-            else:
-                prompt = (prompt[0], prompter.insert_emails_into_prompt(prompt[1]), prompt[2])
+            prompt = (prompt[0], prompter.insert_emails_into_prompt(prompt[1])) + prompt[2:]
 
         if '$entity_name$' in prompt[1]:
             # Update the prompt
-            prompt = (prompt[0], prompt[1].replace("$entity_name$", f"'{prompter.get_entity_name(prompt[3])}'"), prompt[2], prompt[3], prompt[4])
+            prompt = (prompt[0], prompt[1].replace("$entity_name$", f"'{prompter.get_entity_name(prompt[3], prompt[4])}'"), prompt[2], prompt[3], prompt[4])
         
-        if 'modules' in prompt[2]:
+        if len(prompt) == 3 and 'modules' in prompt[2]:
             # Update the modules prompt
             prompt = (prompt[0], prompter.modules_prompt_template(), prompt[2])
 
-        # Add in errors to prompt[1] if any were reported.
-        if errors is not None:
-            print(f"length of prompt tuple before error-feedback mechanism: {len(prompt)}")
-            patched_prompt_1 = f"{prompt[1]}\n"
-
-            if previous_output is not None and retries < 1:
-                patched_prompt_1 += f"In a previous attempt you've generated the following incorrect output:\n\n{previous_output}"
-                patched_prompt_1 += f"\n\nThe output above has the following errors:\n"
-                for e_index,error in enumerate(errors):
-                    patched_prompt_1 += f"[Error {e_index+1}] {error}\n"
-                patched_prompt_1 += f"\nTry again by fixing these errors."
-            else:
-                patched_prompt_1 += f"Avoid the following errors when generating output:\n"
-                for e_index,error in enumerate(errors):
-                    patched_prompt_1 += f"[Error {e_index+1}] {error}\n"
-
-            print(f"(prompt[0], patched_prompt_1): {(prompt[0], patched_prompt_1)}")
-            print(f"prompt[2:-1]: {prompt[2:-1]}")
-            print(f"(prompt[0], patched_prompt_1) + prompt[2:-1]: {(prompt[0], patched_prompt_1) + prompt[2:-1]}")
+        errors = None
+        previous_output = None
 
-            _prompt = (prompt[0], patched_prompt_1) + prompt[2:-1]
-            prompt = _prompt
-            print(f"Length of prompt tuple after error-feedback mechanism: {len(prompt)}")
+        for attempt in range(retry_policy.max_retries + 1):
 
-        print(f"Prompt[{index}]: {prompt[1]}\n")
-        generated_output = llm.execute_prompt(prompt)
+            # Retries start from the original prompt, adding only the output and errors of the previous attempt.
+            attempt_prompt = prompt if errors is None else retry_policy.retry_prompt(prompt, errors, previous_output)
 
-        print(f"Output[{index}]: {generated_output}\n")
+            candidates = speculation_policy.candidates(record['section'], telemetry)
 
-        generated_yaml = llm.extract_yaml(generated_output)
+            print(f"Prompt[{index}] (attempt {attempt + 1}" + (f", {candidates} candidates" if candidates > 1 else "") + f"): {attempt_prompt[1]}\n")
 
-        original_generated_yaml_string = yaml.dump(generated_yaml, default_flow_style=False)
+            if candidates == 1:
+                outcomes = [generate_candidate(llm, validator, index, attempt_prompt, prompt[2], 0)]
+            else:
+                outcomes = speculate(candidates, lambda candidate, cancelled: generate_candidate(llm, validator, index, attempt_prompt, prompt[2], candidate, cancelled))
 
-        # prompt[2] is the 3rd element of the prompt and contains the reference sample
-        validation_result, errors = validator.validate(generated_yaml, prompt[2])
+            # Every candidate that completed counts as an attempt, candidates cancelled before completing don't.
+            for outcome in outcomes:
+                record['attempts'] += 1
+                record['stream_aborts'] += 1 if outcome['status'] == 'aborted' else 0
+                record['parse_failures'] += 1 if outcome['status'] == 'unparsable' else 0
+                for key in outcome['usage']:
+                    usage[key] = usage.get(key, 0) + outcome['usage'][key]
 
-        validated_generated_yaml_string = yaml.dump(generated_yaml, default_flow_style=False)
+            # Keep the lowest numbered candidate that passed, or retry from the candidate closest to passing.
+            passed = [x for x in outcomes if x['status'] == 'passed']
+            outcome = min(passed, key=lambda x: x['candidate']) if len(passed) > 0 else min(outcomes, key=lambda x: (x['status'] != 'invalid', len(x['errors']), x['candidate']))
+            errors = outcome['errors']
+            previous_output = outcome['output']
 
-        if original_generated_yaml_string != validated_generated_yaml_string:
-            print(f"Cleaning happened during validation!")
-            print(f"Original Generated Output:\n{original_generated_yaml_string}\nAfter Validation:\n{validated_generated_yaml_string}")
+            if outcome['status'] == 'aborted':
+                print(f"Aborted streamed output[{index}]" + (", retrying." if attempt < retry_policy.max_retries else ", out of retries."))
+                continue
 
+            if outcome['status'] == 'unparsable':
+                print(f"Generated yaml failed to parse" + (", retrying." if attempt < retry_policy.max_retries else ", out of retries."))
+                continue
 
-        print(f"{len(errors)} validation errors.")
+            generated_yaml = outcome['yaml']
+            validation_result = outcome['status'] == 'passed'
 
+            # Main users and instructors generated by other processes are only known to the registry.
+            if validation_result and registry is not None:
+                errors = registry.reserve_section(generated_yaml)
+                validation_result = len(errors) == 0
 
-        # If the generated artifacts pass validation
-        if validation_result:
+            print(f"{len(errors)} validation errors.")
+            record['validation_errors'] += sum([len(x['errors']) for x in outcomes if x['status'] == 'invalid']) + (len(errors) if outcome['status'] == 'passed' else 0)
 
-            # Capture the generated main user so we can avoid duplicating them over the course of the generation session.
-            if 'main_user' in generated_yaml:
-                Prompter.MAIN_USERS.append(generated_yaml['main_user'])
-                print(f"MAIN_USERS: {Prompter.MAIN_USERS}")
-            # Capture the generated instructors so we can avoid duplicating them over the course of the generation session. 
-            if 'instructor' in generated_yaml:
-                Prompter.INSTRUCTORS.append(generated_yaml['instructor'])
-                print(f"INSTRUCTORS: {Prompter.INSTRUCTORS}")
 
+            # If the generated artifacts pass validation
+            if validation_result:
+                store_section(prompter, generated_course, prompt[3] if len(prompt) > 3 else None, prompt[4] if len(prompt) > 4 else None, generated_yaml)
+                checkpoint(prompt, generated_yaml)
 
-            # updated our generated course dict with the new data.
+                return record_telemetry(True)
 
-            if len(prompt) > 3: # If the prompt contains a key and index because the generated result is an item in the 'assignments', 'discussions', 'announcements', or 'quizzes' section. 
-                # prompt[3] should be the key name from the reference course containing the complex objects which needed to be generated one at a time.
-                if prompt[3] == 'assignments': # Still need to capture generated assignment values
-                    prompter.add_valid_assignment(generated_yaml['title'])
+            print(f"Generated data failed to pass validation:\n")
+            for e_index,error in enumerate(errors):
+                print(f"[Error {e_index+1}] {error}")
 
-                if prompt[3] == 'pages': # Still need to capture generated page values.
-                    prompter.add_valid_page(generated_yaml['title'])
+            if attempt < retry_policy.max_retries:
+                print(f"Retrying...")
 
-                if "_names"  in prompt[3]: # If the purpose of the prompt was just to generate some names, update the prompter with those names and move on.
-                    prompter.add_entity_names(prompt[3].split('_')[0], generated_yaml)
-                    return
+        print(f"Out of retries!")
+        return record_telemetry(False)
 
-                if prompt[3] not in generated_course:
-                    generated_course[prompt[3]] = []
-                
-                
-                generated_course[prompt[3]].append(generated_yaml) # Insert the generated item at a matching index in the generated course object.
-                print(f"Inserted generated output into '{prompt[3]}' of the generated_course. Generated course currently has {len(generated_course[prompt[3]])} {prompt[3]}.")
-            else:
-                # Handle 'normal' section.
-                generated_course.update(generated_yaml)
-        else:
-            if retries < 5:
-                print(f"Generated data failed to pass validation:\n")
-                for e_index,error in enumerate(errors):
-                    print(f"[Error {e_index+1}] {error}")
-                    print(f"Adding errors to prompt for retry...")
-                print(f"Retrying...")
-                generate_section(llm, prompter, validator, index, prompt, generated_course, retries + 1, errors, validated_generated_yaml_string)
-            else:
-                print(f"Generated data failed to pass validation:\n")
-                for e_index,error in enumerate(errors):
-                    print(f"[Error {e_index+1}] {error}")
-                print(f"Out of retries!")
-    except IndexError:
+    # Raised when the names the prompt refers to failed to generate, or came out short.
+    except (IndexError, KeyError):
         print(f"prompt size: {len(prompt)} prompt:\n{prompt}")
         error_msg = traceback.format_exc()
         print(error_msg)
-        sys.exit(1)    
+        raise GenerationFailed(f"Prompt[{index}] for {prompt_section(prompt)} can't be completed: {error_msg.strip().splitlines()[-1]}")
 
-    except yaml.scanner.ScannerError:
-        if retries < 5:
-            print(f"Generated yaml failed to parse, retrying.")
-            generate_section(llm, prompter, validator, index, prompt, generated_course, retries + 1, ["Output failed to parse as yaml!"], generated_output)
-        else:
-            print(f"Generated yaml failed to parse, out of retries.")
-    except yaml.parser.ParserError:
-        if retries < 5:
-            print(f"Generated yaml failed to parse, retrying.")
-            generate_section(llm, prompter, validator, index, prompt, generated_course, retries + 1, ["Output failed to parse as yaml!"], generated_output)
+
+'''
+Generates a batch of elements of a section in a single request. Each generated element is validated against its own seed element,
+and stored as soon as it passes. Only the elements that fail are re-requested, one element per prompt, by generate_section().
+'''
+def generate_batch(llm, prompter, validator, index, prompt, generated_course, retry_policy, telemetry, checkpoint):
+    key, indexes = prompt[3], prompt[4]
+
+    start_time = time.time()
+    usage = {}
+    record = {
+        "course": prompter.course,
+        "section": prompt_section(prompt),
+        "index": indexes,
+        "attempts": 1,
+        "validation_errors": 0,
+        "parse_failures": 0,
+        "stream_aborts": 0,
+        "passed": False
+    }
+
+    if '$emails$' in prompt[1]:
+        prompt = (prompt[0], prompter.insert_emails_into_prompt(prompt[1])) + prompt[2:]
+
+    if '$entity_name$' in prompt[1]:
+        try:
+            prompt = (prompt[0], prompt[1].replace("$entity_name$", ', '.join([f"'{prompter.get_entity_name(key, x)}'" for x in indexes]))) + prompt[2:]
+        except (IndexError, KeyError) as e:
+            raise GenerationFailed(f"Prompt[{index}] for a batch of {key} can't be completed, its names are missing: {type(e).__name__}: {e}")
+
+    print(f"Prompt[{index}] (batch of {len(indexes)} {key}): {prompt[1]}\n")
+    try:
+        generated_output = llm.execute_prompt(prompt, usage, lambda output: validator.partial_structure_errors(llm.partial_yaml(output), prompt[2]))
+        print(f"Output[{index}]: {generated_output}\n")
+        generated_yaml = llm.extract_yaml(generated_output)
+    except StreamAborted as e:
+        print(f"Aborted streamed batch[{index}], generating its elements one at a time: {e.errors}\n{e.output}\n")
+        generated_yaml = []
+        record['stream_aborts'] += 1
+    except (yaml.scanner.ScannerError, yaml.parser.ParserError):
+        print(f"Generated batch failed to parse, generating its elements one at a time.")
+        generated_yaml = []
+        record['parse_failures'] += 1
+
+    if not isinstance(generated_yaml, list):
+        print(f"Generated batch is not a list, generating its elements one at a time.")
+        generated_yaml = []
+        record['validation_errors'] += 1
+
+    failed = []
+    for position, element_index in enumerate(indexes):
+        if position >= len(generated_yaml):
+            failed.append(element_index)
+            continue
+
+        element_prompt = prompter.element_prompt(key, element_index)
+        try:
+            validation_result, errors = validator.validate(generated_yaml[position], element_prompt[2])
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            validation_result, errors = False, [f"Output does not match the structure of the snippet ({type(e).__name__}: {e})."]
+
+        record['validation_errors'] += len(errors)
+
+        if validation_result:
+            store_section(prompter, generated_course, key, element_index, generated_yaml[position])
+            checkpoint(element_prompt, generated_yaml[position])
         else:
-            print(f"Generated yaml failed to parse, out of retries.")
+            print(f"Generated {key}[{element_index}] failed to pass validation:\n")
+            for e_index,error in enumerate(errors):
+                print(f"[Error {e_index+1}] {error}")
+            failed.append(element_index)
 
+    print(f"{len(indexes) - len(failed)} of {len(indexes)} generated {key} passed validation.")
 
-def generate_course(llm, existing_courses, retries ):
-     # Initalize the prompter
-    prompter = Prompter(seed_data)
+    record['passed'] = len(failed) == 0
+    record['latency'] = round(time.time() - start_time, 3)
+    record['requests'] = usage.get('requests', 0)
+    record['cache_hits'] = usage.get('cache_hits', 0)
+    record['input_tokens'] = usage.get('input_tokens', 0)
+    record['output_tokens'] = usage.get('output_tokens', 0)
+    telemetry.record(record)
 
-    # Initalize the validator
-    validator = Validator(seed_data, prompter)
+    passed = True
+    for element_index in failed:
+        passed = generate_section(llm, prompter, validator, index, prompter.element_prompt(key, element_index), generated_course, retry_policy, telemetry, checkpoint) and passed
+    return passed
 
-     # Generate the name of the new course
-    new_course = llm.execute_prompt(prompter.course_selection_prompt(existing_courses))
-    print(f"Generating test data for {new_course}")
-    prompter.set_course(new_course)
 
-    # Initalize object to hold generated course content.
-    generated_course = {}
+def generate_course(llm, existing_courses, retry_policy, course_number, resumed=None):
 
-    prompts = prompter.generate_prompts()
+    # Regenerate the whole course if it comes out missing any of the root keys of the seed course.
+    for attempt in range(retry_policy.max_retries + 1):
 
-    print(f"Need to generate {len(prompts)} elements.")
-    print(f"Element generation prompts:")
+        # Pick up the main users and instructors of the courses generated by other processes, to keep them out of our prompts.
+        if registry is not None:
+            with generation_lock:
+                for kind, people in [('main_user', Prompter.MAIN_USERS), ('instructor', Prompter.INSTRUCTORS)]:
+                    known = [(x['name'], x['email']) for x in people]
+                    people.extend([x for x in registry.people(kind) if (x['name'], x['email']) not in known])
 
-    for index,prompt in enumerate(prompts):
-        print(f"{index} - {str(prompt[3:4:1])}\n")
+        # Initalize the prompter
+        prompter = Prompter(seed_data, args.batch_size, args.batch_sections)
 
+        # Initalize the validator
+        validator = Validator(seed_data, prompter)
 
-    start_time = time.time()
+        # Initalize object to hold generated course content.
+        generated_course = {}
 
-    for index, prompt in enumerate(prompts):
-        generate_section(llm, prompter, validator, index, prompt, generated_course, 0)
-        
-    print(f"Generated course in {time.time() - start_time}s.")
+        # Sections generated before the run was interrupted, as (section, index) pairs.
+        journaled_sections = set()
 
-    print(f"Seed course root-level keys: {prompter.seed_course.keys()}")
-    print(f"Generated course root-level keys: {generated_course.keys()}")
+        if attempt == 0 and resumed is not None:
+            new_course = resumed['course']
+            print(f"Resuming generation of {new_course} from {len(resumed['sections'])} journaled sections")
+            prompter.set_course(new_course)
 
-    # Validate that the new course has all the same root keys as the seed course
-    for key in prompter.seed_course:
+            for section in resumed['sections']:
+                store_section(prompter, generated_course, section['key'], section['index'], yaml.safe_load(section['yaml']))
+                journaled_sections.add((section['section'], section['index']))
+        else:
+            # Generate the name of the new course
+            start_time = time.time()
+            usage = {}
 
-        if key not in generated_course and retries < 5:
-            print(f"Generated course is missing '{key}' field! Trying again...")
-            return generate_course(llm, existing_courses, retries + 1)
-        
-        if key not in generated_course and retries >= 5:
-            print(f"Generated course is missing '{key}' field. Out of retries!")
-            sys.exit(1)
-    
-    return generated_course
+            if registry is None:
+                new_course = llm.execute_prompt(prompter.course_selection_prompt(existing_courses), usage)
+            else:
+                # Courses generated by other processes are only known to the registry.
+                for _ in range(retry_policy.max_retries + 1):
+                    new_course = llm.execute_prompt(prompter.course_selection_prompt(existing_courses + [x for x in registry.courses() if x not in existing_courses]), usage)
+                    if registry.reserve_course(new_course):
+                        break
+                    print(f"Course {new_course} is already being generated, generating another course name.")
+
+            print(f"Generating test data for {new_course}")
+            prompter.set_course(new_course)
+
+            telemetry.record({
+                "course": new_course,
+                "section": "course_name",
+                "index": None,
+                "attempts": 1,
+                "validation_errors": 0,
+                "parse_failures": 0,
+                "stream_aborts": 0,
+                "passed": True,
+                "latency": round(time.time() - start_time, 3),
+                "requests": usage.get('requests', 0),
+                "cache_hits": usage.get('cache_hits', 0),
+                "input_tokens": usage.get('input_tokens', 0),
+                "output_tokens": usage.get('output_tokens', 0)
+            })
+
+            journal.write({"type": "course_start", "course_number": course_number, "course": new_course})
+
+        def checkpoint(prompt, generated_yaml):
+            journal.write({
+                "type": "section",
+                "course_number": course_number,
+                "section": prompt_section(prompt),
+                "key": prompt[3] if len(prompt) > 3 else None,
+                "index": prompt[4] if len(prompt) > 4 else None,
+                "yaml": yaml.dump(generated_yaml, default_flow_style=False)
+            })
+
+        prompts = prompter.generate_prompts()
+
+        # Batches partially generated before the run was interrupted only generate the elements missing from the journal.
+        for index, prompt in enumerate(prompts):
+            if is_batch_prompt(prompt):
+                missing = [x for x in prompt[4] if (prompt[3], x) not in journaled_sections]
+                if 0 < len(missing) < len(prompt[4]):
+                    prompts[index] = prompter.batch_prompt(prompt[3], missing)
+
+        completed = {index for index, prompt in enumerate(prompts) if all([(prompt_section(prompt), x) in journaled_sections for x in prompt_indexes(prompt)])}
+
+        print(f"Need to generate {len(prompts) - len(completed)} elements.")
+        print(f"Element generation prompts:")
+
+        for index,prompt in enumerate(prompts):
+            if index not in completed:
+                print(f"{index} - {str(prompt[3:4:1])}\n")
+
+
+        start_time = time.time()
+
+        # Independent prompts are generated concurrently, up to args.concurrency at a time.
+        run_prompts(prompts, prompter.prompt_dependencies(prompts), lambda index, prompt: (generate_batch if is_batch_prompt(prompt) else generate_section)(llm, prompter, validator, index, prompt, generated_course, retry_policy, telemetry, checkpoint), args.concurrency, completed)
+
+        print(f"Generated course in {time.time() - start_time}s.")
+
+        print(f"Seed course root-level keys: {prompter.seed_course.keys()}")
+        print(f"Generated course root-level keys: {generated_course.keys()}")
+
+        # Validate that the new course has all the same root keys as the seed course
+        missing_keys = [key for key in prompter.seed_course if key not in generated_course]
+
+        if len(missing_keys) == 0:
+            journal.write({"type": "course_done", "course_number": course_number, "yaml": yaml.dump(generated_course, default_flow_style=False)})
+            return generated_course
+
+        if attempt < retry_policy.max_retries:
+            print(f"Generated course is missing {missing_keys} field(s)! Trying again...")
+
+    print(f"Generated course is missing {missing_keys} field(s). Out of retries!")
+    raise GenerationFailed(f"Course {course_number} is missing {missing_keys} field(s) after {retry_policy.max_retries + 1} attempts.")
 
 # Initalize Arg Parser
 parser = argparse.ArgumentParser(description="Course data generation script. This script generates sample course and user content data in a format suitable for the data generation ruby scripts responsible for configuring a canvas environment. It requires one seed course worth of test data to start.")
@@ -640,6 +1609,119 @@ parser.add_argument('-m', '--model',
                     default="gpt-5-mini"
 )
 
+parser.add_argument('--openai-base-url',
+                    dest="openai_base_url",
+                    help="Base URL of the OpenAI API, eg: http://127.0.0.1:8766/v1 to generate against mock_openai_server.py."
+)
+
+parser.add_argument('--llm-cache',
+                    dest="llm_cache",
+                    help="Path to a directory caching LLM responses by model and prompt. Reruns with identical prompts are served from the cache rather than the OpenAI API."
+)
+
+parser.add_argument('--llm-cache-mode',
+                    dest="llm_cache_mode",
+                    help="'rw' serves responses from the cache and records new ones, 'ro' serves responses from the cache only and fails on prompts missing from it, 'off' bypasses the cache.",
+                    choices=LLM.CACHE_MODES,
+                    default="rw"
+)
+
+parser.add_argument('-c', '--concurrency',
+                    dest="concurrency",
+                    help="The maximum number of prompts executed concurrently while generating a course. Prompts only wait on the prompts they depend on.",
+                    default=4,
+                    type=int
+)
+
+parser.add_argument('--stream',
+                    dest="stream",
+                    action="store_true",
+                    help="Stream LLM responses and check them as they arrive, aborting and retrying those whose structure can no longer pass validation."
+)
+
+parser.add_argument('--speculative-sections',
+                    dest="speculative_sections",
+                    help="The section types, eg: quizzes or quizzes_names, generated from several candidate requests sent concurrently, keeping the first candidate to pass validation. Disabled while the LLM cache is in use, as replays can't tell which candidate passed first. Candidates still running when another passes are not counted in telemetry, though requests that can't be aborted are still billed.",
+                    nargs="+",
+                    default=[]
+)
+
+parser.add_argument('--max-candidates',
+                    dest="max_candidates",
+                    help="The maximum number of concurrent candidates per attempt at a --speculative-sections section. The number of candidates adapts to the failure rate of each section type.",
+                    default=3,
+                    type=int
+)
+
+parser.add_argument('--batch-size',
+                    dest="batch_size",
+                    help="The number of elements of the --batch-sections sections generated per prompt. Elements failing validation are re-requested one at a time. 1 generates every element on its own.",
+                    default=1,
+                    type=int
+)
+
+parser.add_argument('--batch-sections',
+                    dest="batch_sections",
+                    help="The sections generated --batch-size elements per prompt.",
+                    nargs="+",
+                    choices=list(Prompter.ELEMENT_SECTIONS),
+                    default=Prompter.BATCHABLE_SECTIONS
+)
+
+parser.add_argument('--telemetry',
+                    dest="telemetry",
+                    help="Path to a .jsonl file to append per prompt telemetry to: latency, tokens, attempts, validation errors and parse failures."
+)
+
+parser.add_argument('--journal',
+                    dest="journal_path",
+                    help="Path of the checkpoint journal every validated section is appended to. Defaults to the output path with a .journal.jsonl suffix. Without --resume, an existing journal is moved aside to the same path with a timestamp suffix."
+)
+
+parser.add_argument('--resume',
+                    dest="resume",
+                    action="store_true",
+                    help="Resume an interrupted run from its checkpoint journal, only generating the courses and sections missing from it."
+)
+
+parser.add_argument('-w', '--workers',
+                    dest="workers",
+                    help="The number of worker processes generating courses in parallel.",
+                    default=1,
+                    type=int
+)
+
+parser.add_argument('--registry',
+                    dest="registry_path",
+                    help="Path to the SQLite registry reserving main users, instructors and course names across worker processes, and across runs sharing it. Defaults to the output path with a .registry.db suffix when using several workers."
+)
+
+parser.add_argument('--max-retries',
+                    dest="max_retries",
+                    help="The number of times a failed OpenAI request, section or course is retried.",
+                    default=5,
+                    type=int
+)
+
+parser.add_argument('--retry-context-chars',
+                    dest="retry_context_chars",
+                    help="The maximum number of characters of a failed output included in the prompt retrying it.",
+                    default=4000,
+                    type=int
+)
+
+parser.add_argument('--rpm',
+                    dest="rpm",
+                    help="The OpenAI requests per minute limit of our usage tier. Requests are throttled to stay within it.",
+                    type=int
+)
+
+parser.add_argument('--tpm',
+                    dest="tpm",
+                    help="The OpenAI tokens per minute limit of our usage tier. Requests are throttled to stay within it.",
+                    type=int
+)
+
 args = parser.parse_args()
 
 # Resolve OpenAI API key from environment variables if not provided in commandline. 
@@ -651,11 +1733,27 @@ if args.openai_key is None:
     raise RuntimeError("No OpenAI API key specified, please provide it via commandline with the '--open-ai-key' or '-k' flag or set it via an environment variable 'OPENAI_API_KEY' and try again.")
 
 # Initalize API client.
-llm = LLM(args.openai_key, args.model)
+retry_policy = RetryPolicy(max_retries=args.max_retries, max_context_chars=args.retry_context_chars)
+token_bucket = TokenBucket(args.rpm, args.tpm)
+llm = LLM(args.openai_key, args.model, args.llm_cache, args.llm_cache_mode, args.openai_base_url, retry_policy, token_bucket, args.stream)
+
+telemetry = Telemetry(args.telemetry)
 
 # Load seed data
 seed_data = yaml.safe_load(args.seed_file)
 
+seed_sections = Prompter(seed_data).sections()
+unknown_sections = [x for x in args.speculative_sections if x not in seed_sections]
+if len(unknown_sections) > 0:
+    parser.error(f"Unknown --speculative-sections {unknown_sections}, the sections of the seed course are {seed_sections}")
+
+# Which candidate passes first depends on timing, so speculation would keep runs from replaying from the cache.
+if len(args.speculative_sections) > 0 and llm.cache_mode != 'off':
+    print(f"Speculative generation is disabled while the LLM cache is in use (--llm-cache-mode {llm.cache_mode}).")
+    args.speculative_sections = []
+
+speculation_policy = SpeculationPolicy(args.speculative_sections, args.max_candidates)
+
 existing_courses = [seed_data["courses"][0]["name"]]
 
 output_structure = {
@@ -663,14 +1761,84 @@ output_structure = {
     "courses": []
 }
 
-for i in range(args.num_courses):
-   
+journal = Journal(args.journal_path if args.journal_path else f"{args.output_path}.journal.jsonl", args.resume)
+
+registry = None
+if args.workers > 1 or args.registry_path:
+    registry = UniquenessRegistry(args.registry_path if args.registry_path else f"{args.output_path}.registry.db")
+    # The default registry only lives as long as the run, a registry given with --registry can be shared by several runs.
+    if not args.resume and not args.registry_path:
+        registry.clear()
+
+# Generated courses by course number, starting with the courses completed before the run was interrupted.
+generated_courses = {}
+if args.resume:
+    for course_number, generated_course in sorted(journal.completed_courses().items()):
+        if course_number >= args.num_courses:
+            continue
+        print(f"Resuming after completed course {course_number}: {generated_course['name']}")
+        Prompter.MAIN_USERS.append(generated_course['main_user'])
+        Prompter.INSTRUCTORS.append(generated_course['instructor'])
+        existing_courses.append(generated_course["name"])
+        generated_courses[course_number] = generated_course
+
+'''
+Generates a course in a worker process. Worker processes are forked, so they start with the state of the main process: the seed data,
+the courses completed so far and the journal. They make their own connections, and hand their telemetry back along with the course.
+Courses that fail to generate come back as None along with the reason, for the main process to report.
+'''
+def generate_course_in_worker(course_number):
+    global llm
+    # Workers split the requests and tokens per minute of our usage tier between them.
+    worker_token_bucket = TokenBucket(args.rpm / args.workers if args.rpm else None, args.tpm / args.workers if args.tpm else None)
+    llm = LLM(args.openai_key, args.model, args.llm_cache, args.llm_cache_mode, args.openai_base_url, retry_policy, worker_token_bucket, args.stream)
+    journal.reopen()
+    telemetry.reopen()
+    registry.connect()
 
-    generated_course = generate_course(llm, existing_courses, 0)
+    try:
+        generated_course = generate_course(llm, existing_courses, retry_policy, course_number, journal.course_in_progress(course_number) if args.resume else None)
+    except GenerationFailed as e:
+        return None, telemetry.records, str(e)
+
+    return generated_course, telemetry.records, None
+
+remaining_courses = [x for x in range(args.num_courses) if x not in generated_courses]
+
+if args.workers > 1 and len(remaining_courses) > 0:
+    # Each worker process generates whole courses, so the registry is what keeps courses from duplicating each other.
+    with multiprocessing.get_context('fork').Pool(min(args.workers, len(remaining_courses))) as pool:
+        failures = []
+        for course_number, (generated_course, records, failure) in zip(remaining_courses, pool.imap(generate_course_in_worker, remaining_courses)):
+            telemetry.records.extend(records)
+            if failure is not None:
+                print(f"Failed to generate course {course_number}: {failure}")
+                failures.append(failure)
+                continue
+            existing_courses.append(generated_course["name"])
+            generated_courses[course_number] = generated_course
+
+    # Like a single process run, a run with failed courses exits without writing its output. The journal keeps the courses that completed.
+    if len(failures) > 0:
+        print(f"{len(failures)} course(s) failed to generate, rerun with --resume to generate them.")
+        journal.close()
+        sys.exit(1)
+else:
+    for i in remaining_courses:
+       
+
+        try:
+            generated_course = generate_course(llm, existing_courses, retry_policy, i, journal.course_in_progress(i) if args.resume else None)
+        except GenerationFailed as e:
+            print(f"Failed to generate course {i}: {e}")
+            journal.close()
+            sys.exit(1)
+
+        existing_courses.append(generated_course["name"])
 
-    existing_courses.append(generated_course["name"])
+        generated_courses[i] = generated_course
 
-    output_structure["courses"].append(generated_course)
+output_structure["courses"] = [generated_courses[x] for x in sorted(generated_courses)]
 
 
 
@@ -696,4 +1864,8 @@ for course in output_structure['courses']:
 with open(args.output_path, 'w') as file:
     yaml.dump(output_structure, file, default_flow_style=False)
 
-print(f"Generated course(s) written to file: {args.output_path}")
\ No newline at end of file
+print(f"Generated course(s) written to file: {args.output_path}")
+
+journal.close()
+
+print_telemetry_summary(telemetry.close())
\ No newline at end of file
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+from core import *
+
+'''
+SQLite backed work queue for spreading evaluation over any number of worker processes, on one machine or on several machines
+sharing storage. Log sizes vary by orders of magnitude between task instances, so rather than statically assigning instances to
+workers, workers claim one task instance at a time until the queue is empty.
+
+A worker claims a job by leasing it, and renews its lease for as long as it is evaluating the job. If the worker crashes, its lease
+expires and the job is reclaimed by another worker.
+
+Example usage:
+
+Enqueue the OdoBot execution events of a run
+python evaluation_queue.py enqueue -q queue.db -t tasks.json --odobot-execution-events /home/aianta/shock_and_awe/odobot_results
+
+Start as many workers as needed, each one exits once every job is done
+python evaluation_queue.py work -q queue.db
+
+Produce the evaluation report, in the same format as evaluation_script.py
+python evaluation_queue.py report -q queue.db -o results.json
+'''
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    instance_id TEXT PRIMARY KEY,
+    artifacts TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, claimed_at);
+"""
+
+def connect(queue_path):
+    # Autocommit mode, transactions are started explicitly with BEGIN IMMEDIATE so that claims are atomic across processes.
+    # The default rollback journal is used rather than WAL, as WAL does not work on network file systems.
+    connection = sqlite3.connect(queue_path, timeout=60, isolation_level=None)
+    connection.executescript(SCHEMA)
+    return connection
+
+def get_meta(connection, key):
+    row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row is not None else None
+
+def load_tasks(tasks_path):
+    print (f"Loading task definitions from: {tasks_path}")
+    with open(tasks_path, 'r') as tasks_file:
+        return [Task(x) for x in json.load(tasks_file)]
+
+def enqueue(args):
+    connection = connect(args.queue)
+    tasks_path = os.path.abspath(args.tasks_file)
+    load_tasks(tasks_path)
+
+    # Group artifacts by the task instance they belong to, each task instance is one job.
+    jobs = {}
+    for kind, path in find_artifacts(args.odobot_execution_events, args.wv_network_logs, args.wv_interact_messages):
+        instance_id = Task.resolve_instance_id(path)
+        if instance_id is None:
+            print(f"Path: {path} does not contain any task instance id.")
+            continue
+        jobs.setdefault(instance_id, []).append((kind, os.path.abspath(path)))
+
+    connection.execute("BEGIN IMMEDIATE")
+    existing_tasks_path = get_meta(connection, 'tasks_file')
+    if existing_tasks_path is not None and existing_tasks_path != tasks_path:
+        connection.execute("ROLLBACK")
+        print(f"Error: queue {args.queue} was created for {existing_tasks_path}, not {tasks_path}.")
+        sys.exit(1)
+
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('tasks_file', ?)", (tasks_path,))
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('answer_timezone', ?)", (args.answer_timezone,))
+    if args.token_prices:
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('token_prices', ?)", (json.dumps(args.token_prices),))
+
+    # Re-enqueueing an instance resets its job, so new artifacts get evaluated.
+    connection.executemany(
+        "INSERT OR REPLACE INTO jobs (instance_id, artifacts, status, attempts) VALUES (?, ?, ?, 0)",
+        [(instance_id, json.dumps(artifacts), PENDING) for instance_id, artifacts in jobs.items()]
+    )
+    connection.execute("COMMIT")
+
+    print(f"Enqueued {len(jobs)} task instance(s) in {args.queue}")
+
+'''
+Atomically claims a pending job, or a claimed job whose lease has expired. Returns (instance_id, artifacts, attempts) or None.
+Claiming a job counts as an attempt, so jobs whose workers keep getting killed (eg: out of memory) run out of attempts too.
+Abandoned jobs that have used all of their attempts are marked as failed rather than claimed again.
+'''
+def claim_job(connection, worker, lease, max_attempts):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(
+            "UPDATE jobs SET status = ?, error = COALESCE(error, ?) WHERE (status = ? OR (status = ? AND claimed_at < ?)) AND attempts >= ?",
+            (FAILED, f"Abandoned after {max_attempts} attempt(s), the worker evaluating it likely crashed or was killed.", PENDING, CLAIMED, time.time() - lease, max_attempts)
+        )
+
+        row = connection.execute(
+            "SELECT instance_id, artifacts, attempts FROM jobs WHERE (status = ? OR (status = ? AND claimed_at < ?)) AND attempts < ? LIMIT 1",
+            (PENDING, CLAIMED, time.time() - lease, max_attempts)
+        ).fetchone()
+
+        if row is not None:
+            connection.execute(
+                "UPDATE jobs SET status = ?, worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE instance_id = ?",
+                (CLAIMED, worker, time.time(), row[0])
+            )
+
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+    if row is None:
+        return None
+
+    return row[0], json.loads(row[1]), row[2] + 1
+
+'''
+Renews the lease on a claimed job. Every claim counts as an attempt, so the attempt number identifies our claim: if the job was reclaimed
+after our lease expired, even by a worker with the same name, nothing is renewed. Returns whether the job is still ours.
+'''
+def renew_lease(connection, worker, instance_id, attempts):
+    return connection.execute(
+        "UPDATE jobs SET claimed_at = ? WHERE instance_id = ? AND worker = ? AND status = ? AND attempts = ?",
+        (time.time(), instance_id, worker, CLAIMED, attempts)
+    ).rowcount > 0
+
+'''
+Renews the lease on a job every 'interval' seconds until 'stopped' is set, so that long evaluations are not reclaimed by other workers.
+Runs on its own thread, with its own connection to the queue.
+'''
+def keep_lease(queue_path, worker, instance_id, attempts, interval, stopped):
+    connection = connect(queue_path)
+    try:
+        while not stopped.wait(interval):
+            if not renew_lease(connection, worker, instance_id, attempts):
+                print(f"Lost the lease on {instance_id}, it was reclaimed by another worker.")
+                break
+    finally:
+        connection.close()
+
+# Only records the outcome if the job is still ours, it may have been reclaimed after our lease expired. Returns whether it was recorded.
+def complete_job(connection, worker, instance_id, attempts, status, result=None, error=None):
+    recorded = connection.execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ? WHERE instance_id = ? AND worker = ? AND status = ? AND attempts = ?",
+        (status, json.dumps(result, default=str) if result is not None else None, error, instance_id, worker, CLAIMED, attempts)
+    ).rowcount > 0
+
+    if not recorded:
+        print(f"Discarding the outcome of {instance_id}, the job was reclaimed after our lease on it expired.")
+    return recorded
+
+def work(args):
+    connection = connect(args.queue)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+
+    tasks_path = get_meta(connection, 'tasks_file')
+    if tasks_path is None:
+        print(f"Error: queue {args.queue} is empty, enqueue some jobs first.")
+        sys.exit(1)
+
+    evaluator = Evaluator()
+    evaluator.register_tasks(load_tasks(tasks_path))
+    evaluator.set_answer_timezone(get_meta(connection, 'answer_timezone'))
+    if get_meta(connection, 'token_prices') is not None:
+        evaluator.set_token_prices(*json.loads(get_meta(connection, 'token_prices')))
+
+    processed = 0
+    while True:
+        job = claim_job(connection, worker, args.lease, args.max_attempts)
+
+        if job is None:
+            # Other workers may still hold claims, if one of them crashes its job will become claimable once the lease expires.
+            outstanding = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (CLAIMED,)).fetchone()[0]
+            if outstanding == 0:
+                break
+            time.sleep(args.poll_interval)
+            continue
+
+        instance_id, artifacts, attempts = job
+
+        # Start every job from a clean slate so memory stays flat over long queues.
+        evaluator.network_events = {}
+        evaluator.outputs = {}
+        evaluator.odobot_targets = {}
+        evaluator.token_usage = {}
+
+        # Renew the lease well before it expires, for as long as the job is being evaluated.
+        stopped = threading.Event()
+        lease_keeper = threading.Thread(target=keep_lease, args=(args.queue, worker, instance_id, attempts, args.lease / 3, stopped), daemon=True)
+        lease_keeper.start()
+
+        try:
+            for kind, path in artifacts:
+                evaluator.load_artifact(kind, path)
+
+            if instance_id not in evaluator.network_events:
+                outcome = (SKIPPED, None, "No network events were found for this task instance.")
+            else:
+                outcome = (DONE, evaluator.evaluate_registered_instance(instance_id), None)
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+            outcome = (FAILED if attempts >= args.max_attempts else PENDING, None, error)
+        finally:
+            stopped.set()
+            lease_keeper.join()
+
+        complete_job(connection, worker, instance_id, attempts, outcome[0], result=outcome[1], error=outcome[2])
+
+        processed += 1
+
+    print(f"Worker {worker} processed {processed} job(s), no jobs left.")
+
+def report(args):
+    connection = connect(args.queue)
+
+    for status, count in connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status ORDER BY status"):
+        print(f"{status}: {count}")
+
+    details = [json.loads(row[0]) for row in connection.execute("SELECT result FROM jobs WHERE status = ? ORDER BY instance_id", (DONE,))]
+    results = Evaluator.summarize(details)
+
+    for instance_id, error in connection.execute("SELECT instance_id, error FROM jobs WHERE status = ?", (FAILED,)):
+        print(f"Evaluation of {instance_id} failed:\n{error}")
+
+    with open(args.output_path, 'w') as out_file:
+        json.dump(results, out_file, indent=4, default=str)
+
+    print(f"{results['correct']}/{results['total']} correct ({results['%_correct']}%). Report written to {args.output_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite backed work queue for evaluating task executions with any number of worker processes.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='Find task execution artifacts and enqueue one job per task instance.')
+    enqueue_parser.add_argument('-q', '--queue', required=True, help='Path to the SQLite queue file, created if it does not exist.')
+    enqueue_parser.add_argument('-t', '--tasks', dest='tasks_file', required=True, help='file path of the tasks.json file produced by the data generation scripts.')
+    enqueue_parser.add_argument('--odobot-execution-events', dest='odobot_execution_events', help='Path to the folder containing Odobot execution event logs in .json format.')
+    enqueue_parser.add_argument('--wv-network-logs', dest='wv_network_logs', help='Path to the directory containing web voyager network logs collected while executing task(s).')
+    enqueue_parser.add_argument('--wv-interact-messages', dest='wv_interact_messages', help='Path to the directory containing web voyager result artifacts including folders that themselves contain interaction_messages.json files.')
+    enqueue_parser.add_argument('--token-prices', dest='token_prices', nargs=2, type=float, metavar=('PROMPT_PRICE', 'COMPLETION_PRICE'), help='Prices in USD per million prompt and completion tokens, used to estimate the cost of WebVoyager task executions.')
+    enqueue_parser.add_argument('--answer-timezone', dest='answer_timezone', default='Canada/Mountain', help='IANA time zone identifier of date time answers to information seeking questions.')
+
+    work_parser = subparsers.add_parser('work', help='Claim and evaluate jobs until the queue is empty.')
+    work_parser.add_argument('-q', '--queue', required=True, help='Path to the SQLite queue file.')
+    work_parser.add_argument('--lease', type=float, default=600, help='Seconds after which a claimed job whose worker stopped renewing its lease is considered abandoned and is reclaimed. Workers renew their leases every third of this.')
+    work_parser.add_argument('--max-attempts', dest='max_attempts', type=int, default=3, help='Number of times a job is attempted before it is marked as failed.')
+    work_parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=5, help='Seconds to wait between checks for reclaimable jobs once no pending jobs are left.')
+
+    report_parser = subparsers.add_parser('report', help='Write the evaluation report for all completed jobs.')
+    report_parser.add_argument('-q', '--queue', required=True, help='Path to the SQLite queue file.')
+    report_parser.add_argument('-o', '--out', dest='output_path', default='evaluation_result.json', help='the path to the evaluation report.')
+
+    args = parser.parse_args()
+
+    if args.command == 'enqueue':
+        enqueue(args)
+    elif args.command == 'work':
+        work(args)
+    elif args.command == 'report':
+        report(args)
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,13 @@ import json
 import argparse
 import os.path
 import os
+import time
+from datetime import datetime
 from zoneinfo import ZoneInfo
 
 from core import *
+from results_store import ResultsStore
+from aggregate_results import aggregate_results, print_aggregates
 
 '''
 Example usage with WebVoyager results:
@@ -19,6 +23,16 @@ To Evaluate Single OdoBot result
 python evaluation_script.py -t tasks.json -o result.json --single-odobot-execution-events path/to/execution_events.json --single-odobot-task-query-construction path/to/task_query_construction.json
 
 
+To Evaluate OdoBot results live while a benchmark run is writing them
+python evaluation_script.py -t tasks.json -o results.json --odobot-execution-events /home/aianta/shock_and_awe/odobot_results --watch
+
+To Evaluate OdoBot results across 3 machines, run one shard on each and merge the shard results
+python evaluation_script.py -t tasks.json -o results_0.json --odobot-execution-events /home/aianta/shock_and_awe/odobot_results --shard 0/3
+python merge_results.py results_0.json results_1.json results_2.json -o results.json
+
+To Evaluate OdoBot results, streaming one JSON line per task instance to the report without printing it
+python evaluation_script.py -t tasks.json -o results.jsonl --odobot-execution-events /home/aianta/shock_and_awe/odobot_results --no-print
+
 To Evaluate Ground truth for sanity checking
 python evaluation_script.py -t tasks.json -o ground_truth.json --odobot-execution-events ./trajectories
 '''
@@ -66,6 +80,18 @@ parser.add_argument("--wv-network-logs",
                     help="Path to the directory containing web voyager network logs collected while executing task(s).",
                     type=lambda x: is_valid_dir(parser, x))
 
+parser.add_argument("--token-prices",
+                    dest="token_prices",
+                    nargs=2,
+                    type=float,
+                    metavar=("PROMPT_PRICE", "COMPLETION_PRICE"),
+                    help="Prices in USD per million prompt and completion tokens, used to estimate the cost of WebVoyager task executions from their token files.")
+
+parser.add_argument("--record-evaluation-time",
+                    dest="record_evaluation_time",
+                    action="store_true",
+                    help="Record how long each task instance took to evaluate in its result, as 'evaluation_time'. Timings vary between runs, so reports made with this flag can't be diffed against each other.")
+
 parser.add_argument("--wv-interact-messages",
                     dest="wv_interact_messages",
                     help="Path to the directory containing web voyager result artifacts including folders that themselves contain interaction_messages.json files collected while executing tasks.",
@@ -87,8 +113,87 @@ parser.add_argument("--single-odobot-task-query-construction",
                     help="Path to the .json file containing the task query construction result for a single task instance"
 )
 
+parser.add_argument("--option-stats",
+                    dest="option_stats",
+                    help="Path to a .json file holding per-task statistics on which answer option passes. Answer options are tried most likely first, and the file is updated with the option each instance passed in this evaluation. Created if it doesn't exist."
+)
+
+parser.add_argument("--watch",
+                    dest="watch",
+                    action="store_true",
+                    help="Keep running, evaluating new or updated logs as they land in the --odobot-execution-events / --wv-network-logs / --wv-interact-messages directories. The results file is kept up to date after every change. Stop with Ctrl+C."
+)
+
+parser.add_argument("--watch-interval",
+                    dest="watch_interval",
+                    help="How often, in seconds, watch mode scans for new or updated logs.",
+                    default=5.0,
+                    type=float
+)
+
+parser.add_argument("--shard",
+                    dest="shard",
+                    help="Only evaluate the task instances belonging to shard i of N, specified as 'i/N' with 0 <= i < N. Instances are assigned to shards by hashing their id, so machines running different shards of the same task pack evaluate disjoint subsets. Combine shard results with merge_results.py."
+)
+
+parser.add_argument("--output-format",
+                    dest="output_format",
+                    choices=["json", "jsonl"],
+                    help="Format of the evaluation report. 'json' writes the whole report at the end of the evaluation. 'jsonl' writes one JSON line per task instance as soon as it is evaluated, followed by a summary record, keeping memory flat and preserving partial results if the evaluation crashes. Defaults to 'jsonl' if the --out path ends with .jsonl, 'json' otherwise."
+)
+
+parser.add_argument("--no-print",
+                    dest="print_results",
+                    action="store_false",
+                    help="Don't print the evaluation report to the terminal, only the summary."
+)
+
+parser.add_argument("--results-db",
+                    dest="results_db",
+                    help="Path to a SQLite results store (see results_store.py) to append the results of this evaluation to as a new run. Created if it doesn't exist."
+)
+
+parser.add_argument("--run-id",
+                    dest="run_id",
+                    help="Id of the run in the results store. Defaults to the name of the --out file followed by a timestamp."
+)
+
+parser.add_argument("--agent",
+                    dest="agent",
+                    help="Name of the agent (configuration) whose task executions are being evaluated, recorded in the results store."
+)
+
+parser.add_argument("--pack",
+                    dest="pack",
+                    help="Name of the task pack being evaluated, recorded in the results store. Defaults to the path of the tasks file."
+)
+
+parser.add_argument("--aggregate-out",
+                    dest="aggregate_out",
+                    help="Path to a .json file to write results aggregated by task, task type, answer type and task parameter values to (see aggregate_results.py)."
+)
+
 args = parser.parse_args()
 
+if args.output_format is None:
+    args.output_format = "jsonl" if args.output_path.endswith(".jsonl") else "json"
+
+if args.shard:
+    try:
+        shard_index, number_of_shards = [int(x) for x in args.shard.split('/')]
+    except ValueError:
+        parser.error(f"Invalid --shard value: {args.shard}, expected 'i/N'.")
+
+    if number_of_shards < 1 or shard_index < 0 or shard_index >= number_of_shards:
+        parser.error(f"Invalid --shard value: {args.shard}, expected 0 <= i < N.")
+
+def in_shard(path):
+    if not args.shard:
+        return True
+
+    instance_id = Task.resolve_instance_id(path)
+    return instance_id is not None and Task.shard_of(instance_id, number_of_shards) == shard_index
+
 # Initalize the Evaluator that perfoms the core evaluation logic
 evaluator = Evaluator()
 
@@ -101,71 +206,186 @@ task_list = [Task(x) for x in task_list]
 
 evaluator.register_tasks(task_list)
 
-if args.single_odobot_execution_events:
+if args.single_odobot_execution_events and in_shard(args.single_odobot_execution_events):
     event_log = OdoBotExecutionEventLog.to_execution_event_log(args.single_odobot_execution_events)
     if event_log is not None:
         evaluator.register_network_events(event_log.task_instance, event_log.network_events)
     if args.single_odobot_task_query_construction:
         with open(args.single_odobot_task_query_construction, 'r', encoding="utf-8", errors="ignore") as tqc_file:
             task_query_construction_result = json.load(tqc_file)
-            task_instance_id = next(x for x in Task.ALL_TASK_INSTANCES if x in args.single_odobot_execution_events)
+            task_instance_id = Task.resolve_instance_id(args.single_odobot_execution_events)
             evaluator.register_odobot_target(task_instance_id, task_query_construction_result['targets'][0])
 
 if args.odobot_execution_events:
     print (f"Looking for Odobot execution event logs in: {args.odobot_execution_events}")
-    with os.scandir(args.odobot_execution_events) as _dir:
-        for entry in _dir:
-            if entry.name.endswith('.json') and 'task-query' not in entry.name and 'history' not in entry.name: #If it is a json file, try and parse it as a OdoBotExecutionEventLog
-                event_log = OdoBotExecutionEventLog.to_execution_event_log(entry.path)
-                if event_log is not None:
-                    evaluator.register_network_events(event_log.task_instance, event_log.network_events)
-            # Load task query construction results as well so we can automatically evaluate if the bot chose a correct target API/GraphQL endpoint for the task
-            if entry.name.endswith('.json') and 'task-query' in entry.name and 'history' not in entry.name:
-                with open(entry.path, 'r') as tqc_file:
-                    task_query_construction_result = json.load(tqc_file)
-                    task_instance_id = next(x for x in Task.ALL_TASK_INSTANCES if x in entry.path)
-                    evaluator.register_odobot_target(task_instance_id, task_query_construction_result['targets'][0] )
-
-
 
 if args.wv_network_logs:
     print (f"Looking for WebVoyager Network Logs in: {args.wv_network_logs}")
-    with os.scandir(args.wv_network_logs) as _dir:
-        for entry in _dir:
-            if entry.name.endswith('.json') and 'token' not in entry.name: # If it is a json file, try and parse it as a WebVoyagerNetworkLog
-                network_log = WebVoyagerNetworkLog.to_network_log(entry.path)
-                if network_log is not None:
-                    evaluator.register_network_events(network_log.task_instance, network_log.network_events)
-
-
 
 if args.wv_interact_messages:
     print (f"Looking for WebVoyager Interaction Messages in: {args.wv_interact_messages}")
 
-    '''
-    Structure of WebVoyager results. The 'wv_interact_messages' path should point to a directory containing directories with names that include 
-    the task instance id. Each of these directories should contain an 'interact_messages.json' file.
-    '''
+'''
+Watch mode keeps track of the modification time and size of every artifact it has loaded, and only re-processes artifacts that changed.
+Artifacts that fail to parse, for example because an agent is still writing them, are retried once they change again.
+'''
+artifact_states = {}
 
-    with os.scandir(args.wv_interact_messages) as _dir:
-        for entry in _dir:
-            for instance in Task.ALL_TASK_INSTANCES:
-                if instance in entry.name:
-                    path_to_interact_messages = entry.path + '/interact_messages.json'
+def load_changed_artifacts():
+    changed_instances = set()
 
-                    if os.path.exists(path_to_interact_messages) and os.path.isfile(path_to_interact_messages):
-                        output_obj = WebVoyagerOutput(open(path_to_interact_messages, 'r'), instance)
+    for kind, path in find_artifacts(args.odobot_execution_events, args.wv_network_logs, args.wv_interact_messages):
+        if not in_shard(path):
+            continue
 
-                        evaluator.register_output(output_obj.task_instance, output_obj.output)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+
+        state = (stat.st_mtime_ns, stat.st_size)
+        if artifact_states.get(path) == state:
+            continue
+
+        artifact_states[path] = state
+
+        try:
+            instance_id = evaluator.load_artifact(kind, path)
+        except (json.JSONDecodeError, UnicodeDecodeError, IndexError, KeyError) as e:
+            if not args.watch:
+                raise
+            print(f"Could not load {path} yet ({type(e).__name__}: {e}), will retry once it changes.")
+            continue
+
+        if instance_id is not None:
+            changed_instances.add(instance_id)
+
+    return changed_instances
+
+changed_instances = load_changed_artifacts()
 
 evaluator.set_answer_timezone(args.answer_timezone)
 
-evaluator.status()
+if args.token_prices:
+    evaluator.set_token_prices(*args.token_prices)
 
-results = evaluator.evaluate()
+evaluator.set_record_evaluation_time(args.record_evaluation_time)
 
-print("===============RESULTS===============")
-print(json.dumps(results, indent=4, default=str))
+if args.option_stats:
+    evaluator.load_option_stats(args.option_stats)
 
-with open(args.output_path, 'w') as out_file:
-    json.dump(results, out_file, indent=4, default=str)
+evaluator.status()
+
+def write_results(results):
+    if args.shard:
+        results["shard"] = args.shard
+
+    with open(args.output_path, 'w') as out_file:
+        json.dump(results, out_file, indent=4, default=str)
+
+def print_summary(summary):
+    print(f"{summary['correct']}/{summary['total']} correct ({summary['%_correct']}%)")
+    if 'efficiency' in summary:
+        efficiency = summary['efficiency']
+        print(f"Mean network events: {efficiency['mean_network_events']}, mean mutating requests: {efficiency['mean_mutating_requests']}, mean events to completion: {efficiency['mean_events_to_completion']}, redundant mutations: {efficiency['redundant_mutations']}, failed mutation attempts: {efficiency['failed_mutation_attempts']}")
+    if 'token_usage' in summary and summary['token_usage']['instances'] > 0:
+        token_usage = summary['token_usage']
+        print(f"Tokens: {token_usage['total_tokens']} ({token_usage['prompt_tokens']} prompt, {token_usage['completion_tokens']} completion), {token_usage['mean_tokens_per_instance']} per instance, {token_usage['tokens_per_success']} per success")
+        if 'estimated_cost' in token_usage:
+            print(f"Estimated cost: ${token_usage['estimated_cost']}, ${token_usage['mean_cost_per_instance']} per instance, ${token_usage['cost_per_success']} per success")
+
+jsonl_writer = None
+if args.output_format == "jsonl":
+    jsonl_writer = JsonlResultsWriter(args.output_path, {"shard": args.shard} if args.shard else None)
+
+if args.watch:
+    '''
+    Evaluate task instances as their artifacts land, keeping the results file and summary up to date, until interrupted.
+    '''
+    results_by_instance = {}
+
+    try:
+        while True:
+            for instance_id in sorted(changed_instances):
+                if instance_id in evaluator.network_events:
+                    # Evaluated once its output lands, which counts as a change of the instance.
+                    if evaluator.is_awaiting_output(instance_id):
+                        print(f"Task instance {instance_id} is information seeking, waiting for its output before evaluating it.")
+                        continue
+
+                    result = evaluator.evaluate_registered_instance(instance_id)
+                    if jsonl_writer is not None:
+                        jsonl_writer.write(result)
+                    else:
+                        results_by_instance[instance_id] = result
+
+            if len(changed_instances) > 0:
+                if jsonl_writer is not None:
+                    jsonl_writer.write_summary()
+                    summary = jsonl_writer.summary()
+                else:
+                    summary = Evaluator.summarize(list(results_by_instance.values()))
+                    write_results(summary)
+
+                if args.option_stats:
+                    evaluator.save_option_stats(args.option_stats)
+
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] {summary['correct']}/{summary['total']} correct ({summary['%_correct']}%), {len(changed_instances)} updated task instance(s). Results written to {args.output_path}")
+
+            time.sleep(args.watch_interval)
+            changed_instances = load_changed_artifacts()
+    except KeyboardInterrupt:
+        print("Stopped watching for new task executions.")
+
+    # Once watching stops, the results go through the same output path as a batch evaluation.
+    if jsonl_writer is not None:
+        jsonl_writer.close()
+        summary = jsonl_writer.summary()
+    else:
+        summary = Evaluator.summarize(list(results_by_instance.values()))
+        write_results(summary)
+
+else:
+    if jsonl_writer is not None:
+        # Stream results out as they are evaluated rather than building the report in memory.
+        if len(evaluator.outputs) > 0:
+            evaluator.validate()
+
+        print("===============RESULTS===============")
+        for result in evaluator.evaluate_iter():
+            jsonl_writer.write(result)
+            if args.print_results:
+                print(json.dumps(result, default=str))
+
+        jsonl_writer.close()
+        summary = jsonl_writer.summary()
+    else:
+        results = evaluator.evaluate()
+        summary = results
+
+        print("===============RESULTS===============")
+        if args.print_results:
+            print(json.dumps(results, indent=4, default=str))
+
+        write_results(results)
+
+if args.option_stats:
+    evaluator.save_option_stats(args.option_stats)
+
+if args.results_db:
+    run_id = args.run_id if args.run_id else f"{os.path.splitext(os.path.basename(args.output_path))[0]}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    store = ResultsStore(args.results_db)
+    store.add_run(run_id, iter_results(args.output_path), agent=args.agent, pack=args.pack if args.pack else args.tasks_file.name, source=os.path.abspath(args.output_path))
+    store.close()
+    print(f"Results stored as run '{run_id}' in {args.results_db}")
+
+if args.aggregate_out:
+    aggregates = aggregate_results(iter_results(args.output_path))
+    with open(args.aggregate_out, 'w') as aggregate_file:
+        json.dump(aggregates, aggregate_file, indent=4)
+    # Free text parameters (eg: messages) make for one group per task instance, only print the per course groups.
+    print_aggregates(aggregates, parameters=["Course"])
+    print(f"Aggregated results written to {args.aggregate_out}")
+
+print_summary(summary)
+print(f"Results written to {args.output_path}")
@@ -0,0 +1,262 @@
+import json
+import argparse
+import os
+import socketserver
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from core import *
+
+'''
+Long running evaluation server. Task packs are loaded once at startup, after which task instance executions can be evaluated
+over a local HTTP API without paying interpreter startup, tasks.json parsing and Task construction for every completed task.
+
+Example usage:
+
+Start the server with one or more task packs
+python evaluation_server.py -t tasks.json -t other_pack/tasks.json --port 8765
+
+Or listen on a unix socket instead of a TCP port
+python evaluation_server.py -t tasks.json --unix-socket /tmp/canvas-evaluation.sock
+
+Evaluate an OdoBot execution event log on disk, the task instance id is resolved from the path
+curl -X POST localhost:8765/evaluate -d '{"log_path": "path/to/<instance id>_execution_events.json", "log_type": "odobot"}'
+
+Evaluate uploaded WebVoyager network events
+curl -X POST localhost:8765/evaluate -d '{"instance_id": "<instance id>", "log_type": "webvoyager", "events": [...]}'
+
+Evaluate an information seeking task instance
+curl -X POST localhost:8765/evaluate -d '{"instance_id": "<instance id>", "output": "Answer: 42"}'
+
+Request fields:
+ - instance_id: the task instance to evaluate. Optional if log_path contains the instance id.
+ - log_type: 'odobot' (default) or 'webvoyager', the format of the log at log_path or of the uploaded events.
+ - log_path: path to a log file readable by the server.
+ - events: raw log events, used instead of log_path.
+ - output: the final answer produced by the agent, needed for information seeking tasks.
+ - task_query_construction_path: path to an OdoBot task query construction result, used to report the targeted endpoint.
+
+The response is the eval result for the instance, as it appears in the 'details' of evaluation_script.py reports.
+'''
+
+# https://stackoverflow.com/questions/11540854/file-as-command-line-argument-for-argparse-error-message-if-argument-is-not-va
+def is_valid_file(parser, arg):
+    if not os.path.exists(arg):
+        parser.error("The file %s does not exits!" % arg)
+    else:
+        return open(arg, 'r')
+
+parser = argparse.ArgumentParser(description="Evaluation server for Canvas Web Task Benchmark. Keeps task packs loaded in memory and evaluates task executions on request.")
+
+parser.add_argument('-t', '--tasks',
+                    dest="tasks_files",
+                    required=True,
+                    action="append",
+                    help="file path of a tasks.json file produced by the data generation scripts. Can be specified multiple times to load several task packs.",
+                    type=lambda x: is_valid_file(parser, x))
+
+parser.add_argument('--host',
+                    dest="host",
+                    default="127.0.0.1",
+                    help="The interface to listen on.")
+
+parser.add_argument('-p', '--port',
+                    dest="port",
+                    default=8765,
+                    type=int,
+                    help="The TCP port to listen on.")
+
+parser.add_argument('--unix-socket',
+                    dest="unix_socket",
+                    help="Path of a unix socket to listen on instead of a TCP port.")
+
+parser.add_argument('--answer-timezone',
+                    dest="answer_timezone",
+                    help="When providing date time answers to information seeking questions, what timezone will these answers be provided in? Value should be IANA time zone identifier.",
+                    default="Canada/Mountain")
+
+parser.add_argument("--option-stats",
+                    dest="option_stats",
+                    help="Path to a .json file holding per-task statistics on which answer option passes. Loaded at startup to try answer options most likely first, and saved on shutdown.")
+
+
+class EvaluationRequestError(Exception):
+    pass
+
+
+# The type of each request field, see the request fields above.
+REQUEST_FIELD_TYPES = {
+    "instance_id": str,
+    "log_type": str,
+    "log_path": str,
+    "events": list,
+    "output": str,
+    "task_query_construction_path": str
+}
+
+'''
+Checks that an evaluation request is a JSON object whose fields have the expected types, raising EvaluationRequestError otherwise.
+'''
+def validate_request(request):
+    if not isinstance(request, dict):
+        raise EvaluationRequestError(f"The request body should be a JSON object, but is a(n) {type(request).__name__}.")
+
+    for field, field_type in REQUEST_FIELD_TYPES.items():
+        if field in request and not isinstance(request[field], field_type):
+            raise EvaluationRequestError(f"Request field '{field}' should be a(n) {field_type.__name__}, but is a(n) {type(request[field]).__name__}.")
+
+    if 'events' in request and not all(isinstance(x, dict) for x in request['events']):
+        raise EvaluationRequestError("Request field 'events' should be a list of JSON objects.")
+
+'''
+Builds the network events to evaluate from an evaluation request.
+Returns the task instance id and its network events.
+'''
+def network_events_from_request(request):
+    validate_request(request)
+
+    log_type = request.get('log_type', 'odobot')
+    if log_type not in ['odobot', 'webvoyager']:
+        raise EvaluationRequestError(f"Unknown log_type: {log_type}, expected 'odobot' or 'webvoyager'.")
+
+    instance_id = request.get('instance_id')
+
+    if 'log_path' in request:
+        if instance_id is None:
+            instance_id = Task.resolve_instance_id(request['log_path'])
+
+        if not os.path.isfile(request['log_path']):
+            raise EvaluationRequestError(f"Log file {request['log_path']} does not exist!")
+
+        with open(request['log_path'], 'r', encoding="utf-8", errors="ignore") as log_file:
+            raw_events = json.load(log_file)
+    else:
+        raw_events = request.get('events', [])
+
+    if instance_id is None or instance_id not in Task.ALL_TASK_INSTANCES:
+        raise EvaluationRequestError(f"Could not resolve a known task instance for the request, instance_id: {instance_id}")
+
+    if not isinstance(raw_events, list):
+        raise EvaluationRequestError(f"The log should hold a list of events, but holds a(n) {type(raw_events).__name__}.")
+
+    # Events missing the fields of their log type are the client's error, not the server's.
+    try:
+        if log_type == 'odobot':
+            return instance_id, OdoBotExecutionEventLog.parse_network_events(raw_events)
+        else:
+            return instance_id, WebVoyagerNetworkLog.parse_network_events(raw_events)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise EvaluationRequestError(f"Malformed {log_type} events, they should be in the format of {log_type} logs ({type(e).__name__}: {e}).")
+
+
+class EvaluationRequestHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Unix socket clients have no address, BaseHTTPRequestHandler expects one when logging requests.
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix-socket'
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, {
+                "tasks": len(evaluator.tasks),
+                "task_instances": len(Task.ALL_TASK_INSTANCES)
+            })
+        else:
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/evaluate':
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+
+        start_time = time.time()
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            instance_id, network_events = network_events_from_request(request)
+
+            if Task.ALL_TASK_INSTANCES[instance_id].parent_task.type == 'Information Seeking' and not isinstance(request.get('output'), str):
+                raise EvaluationRequestError(f"Task instance {instance_id} belongs to an information seeking task, its evaluation needs the agent's final answer as an 'output' string.")
+
+            # Targets only apply to the request they come with.
+            evaluator.odobot_targets.pop(instance_id, None)
+            try:
+                if 'task_query_construction_path' in request:
+                    with open(request['task_query_construction_path'], 'r', encoding="utf-8", errors="ignore") as tqc_file:
+                        evaluator.register_odobot_target(instance_id, json.load(tqc_file)['targets'][0])
+
+                result = evaluator.evaluate_instance(instance_id, network_events, request.get('output'))
+            finally:
+                evaluator.odobot_targets.pop(instance_id, None)
+        except (EvaluationRequestError, json.JSONDecodeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+
+        print(f"Evaluated {instance_id} in {round((time.time() - start_time)*1000, 2)}ms")
+        self.send_json(200, result)
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+
+    # HTTPServer.server_bind expects a (host, port) server address, unix sockets only have a path.
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = self.server_address
+        self.server_port = 0
+
+
+args = parser.parse_args()
+
+evaluator = Evaluator()
+evaluator.set_answer_timezone(args.answer_timezone)
+
+task_list = []
+# Task instances are looked up by id alone, so packs sharing instance ids would evaluate requests against whichever pack loaded last.
+instance_packs = {}
+for tasks_file in args.tasks_files:
+    print (f"Loading task definitions from: {tasks_file.name}")
+    pack_tasks = [Task(x) for x in json.load(tasks_file)]
+    tasks_file.close()
+
+    collisions = [instance.id for task in pack_tasks for instance in task.instances if instance.id in instance_packs]
+    if len(collisions) > 0:
+        parser.error(f"{len(collisions)} task instance id(s) of {tasks_file.name} are already defined by {sorted(set(instance_packs[x] for x in collisions))}, eg: {collisions[:3]}. Task packs served together must not share task instance ids.")
+
+    instance_packs.update({instance.id: tasks_file.name for task in pack_tasks for instance in task.instances})
+    task_list += pack_tasks
+
+evaluator.register_tasks(task_list)
+
+if args.option_stats:
+    evaluator.load_option_stats(args.option_stats)
+
+if args.unix_socket:
+    if os.path.exists(args.unix_socket):
+        os.remove(args.unix_socket)
+    server = UnixHTTPServer(args.unix_socket, EvaluationRequestHandler)
+    print(f"Evaluation server listening on unix socket: {args.unix_socket}")
+else:
+    server = HTTPServer((args.host, args.port), EvaluationRequestHandler)
+    print(f"Evaluation server listening on http://{args.host}:{args.port}")
+
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    print("Shutting down evaluation server.")
+finally:
+    server.server_close()
+    if args.unix_socket and os.path.exists(args.unix_socket):
+        os.remove(args.unix_socket)
+    if args.option_stats:
+        evaluator.save_option_stats(args.option_stats)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Export evaluation results to a columnar format for analytics.
+
+Flattens the details of one or more evaluation reports (.json or .jsonl) into one row per
+task instance per run, joined with the task metadata of the task pack they were evaluated
+against. Aggregations over many runs then become column scans, eg: with pandas, polars or duckdb.
+
+Requires pyarrow (pip install pyarrow).
+
+Example usage:
+python export_results.py -t tasks.json -o results.parquet run_a.json run_b.jsonl
+python export_results.py -t tasks.json -o results.arrow -f arrow run_a.json
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from core import Task, iter_results
+
+
+COLUMNS = [
+    ('run', 'string'),
+    ('instance_id', 'string'),
+    ('task_id', 'string'),
+    ('task_type', 'string'),
+    ('answer_type', 'string'),
+    ('course', 'string'),
+    ('mapping', 'string'),
+    ('instance_text', 'string'),
+    ('correct', 'bool_'),
+    ('answer_id', 'string'),
+    ('observed_answer', 'string'),
+    ('reference_answer', 'string'),
+    ('network_event_count', 'int64'),
+    ('mutating_request_count', 'int64'),
+    ('first_satisfied_event_index', 'int64'),
+    ('redundant_mutations', 'int64'),
+    ('failed_mutation_attempts', 'int64'),
+    ('prompt_tokens', 'int64'),
+    ('completion_tokens', 'int64'),
+    ('estimated_cost', 'float64'),
+    ('evaluation_time', 'float64'),
+]
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        print("Error: exporting results requires pyarrow, install it with 'pip install pyarrow'.")
+        sys.exit(1)
+
+
+def as_text(value):
+    """Answers can be numbers, dates, strings or lists of those. Store them as text so they fit in one column."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def to_columns(run, results_file):
+    """Build the columns for the task instance results of a single report."""
+    columns = {name: [] for name, _ in COLUMNS}
+
+    for result in iter_results(results_file):
+        instance = Task.ALL_TASK_INSTANCES.get(result['id'])
+        task = instance.parent_task if instance is not None else None
+
+        columns['run'].append(run)
+        columns['instance_id'].append(result['id'])
+        columns['task_id'].append(task.id if task is not None else None)
+        columns['task_type'].append(task.type if task is not None else None)
+        columns['answer_type'].append(getattr(task, 'answer_type', None) if task is not None else None)
+        columns['course'].append(instance.mapping.get('Course') if instance is not None else None)
+        columns['mapping'].append(json.dumps(instance.mapping) if instance is not None else None)
+        columns['instance_text'].append(instance.instance_text if instance is not None else None)
+        columns['correct'].append(bool(result['correct']))
+        columns['answer_id'].append(as_text(result.get('answer_id')))
+        columns['observed_answer'].append(as_text(result.get('observed_answer')))
+        columns['reference_answer'].append(as_text(result.get('reference_answer')))
+        columns['network_event_count'].append(result.get('network_event_count'))
+        columns['mutating_request_count'].append(result.get('mutating_request_count'))
+        columns['first_satisfied_event_index'].append(result.get('first_satisfied_event_index'))
+        columns['redundant_mutations'].append(result.get('redundant_mutations'))
+        columns['failed_mutation_attempts'].append(result.get('failed_mutation_attempts'))
+        columns['prompt_tokens'].append(result.get('prompt_tokens'))
+        columns['completion_tokens'].append(result.get('completion_tokens'))
+        columns['estimated_cost'].append(result.get('estimated_cost'))
+        columns['evaluation_time'].append(result.get('evaluation_time'))
+
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export evaluation results to Parquet or Arrow for analytics.')
+    parser.add_argument('results_files', nargs='+', help='Paths to evaluation reports (.json or .jsonl)')
+    parser.add_argument('-t', '--tasks', dest='tasks_file', required=True, help='Path to the tasks.json file the results were evaluated against')
+    parser.add_argument('-o', '--output', default='results.parquet', help='Output file path')
+    parser.add_argument('-f', '--format', choices=['parquet', 'arrow'], default='parquet', help='Output format (default: parquet)')
+
+    args = parser.parse_args()
+
+    pa = import_pyarrow()
+
+    with open(args.tasks_file, 'r') as f:
+        [Task(x) for x in json.load(f)]
+
+    schema = pa.schema([(name, getattr(pa, _type)()) for name, _type in COLUMNS])
+
+    if args.format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(args.output, schema)
+    else:
+        import pyarrow.ipc as ipc
+        writer = ipc.new_file(args.output, schema)
+
+    # Write one batch per report so memory is bounded by the largest report rather than all of them.
+    rows = 0
+    with writer:
+        for results_file in args.results_files:
+            run = os.path.splitext(os.path.basename(results_file))[0]
+            columns = to_columns(run, results_file)
+            writer.write_table(pa.table(columns, schema=schema))
+            rows += len(columns['instance_id'])
+            print(f"Exported {len(columns['instance_id'])} results from {results_file}")
+
+    print(f"Wrote {rows} rows to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
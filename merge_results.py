@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+
+from core import Evaluator, load_report
+
+'''
+Merges the evaluation reports produced by running evaluation_script.py with --shard i/N on several machines into a single report.
+The totals of the merged report are recomputed from the merged details, exactly as the evaluator computes them.
+
+Example usage:
+python merge_results.py results_0.json results_1.json results_2.json -o results.json
+'''
+
+def load_shard_report(file_path):
+    """Load an evaluation report from a .json or .jsonl file."""
+    try:
+        return load_report(file_path)
+    except Exception as e:
+        print(f"Error loading {file_path}: {e}")
+        sys.exit(1)
+
+def merge_reports(reports):
+    """Merge the details of several evaluation reports, returning the merged report."""
+    details = {}
+
+    for file_path, report in reports:
+        for result in report['details']:
+            if result['id'] in details:
+                print(f"Warning: task instance {result['id']} appears in more than one report, using the result from {file_path}.")
+            details[result['id']] = result
+
+    return Evaluator.summarize(list(details.values()))
+
+def check_shards(reports):
+    """Warn about missing or duplicated shards among the reports being merged."""
+    shards = [report.get('shard') for _, report in reports]
+
+    if any(shard is None for shard in shards):
+        print("Warning: some reports were not produced with --shard, cannot check that all shards are present.")
+        return
+
+    numbers_of_shards = set(int(shard.split('/')[1]) for shard in shards)
+    if len(numbers_of_shards) > 1:
+        print(f"Warning: reports were produced with different numbers of shards: {sorted(numbers_of_shards)}")
+        return
+
+    number_of_shards = numbers_of_shards.pop()
+    shard_indices = [int(shard.split('/')[0]) for shard in shards]
+    missing = sorted(set(range(number_of_shards)) - set(shard_indices))
+    if len(missing) > 0:
+        print(f"Warning: missing results for shard(s) {missing} of {number_of_shards}.")
+    if len(shard_indices) != len(set(shard_indices)):
+        print(f"Warning: some shards appear more than once: {sorted(shard_indices)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge shard evaluation reports into a single report.')
+    parser.add_argument('reports', nargs='+', help='Paths to the shard evaluation reports, in .json or .jsonl format')
+    parser.add_argument('--output', '-o', default='evaluation_result.json', help='Output JSON file path')
+
+    args = parser.parse_args()
+
+    reports = [(file_path, load_shard_report(file_path)) for file_path in args.reports]
+
+    check_shards(reports)
+
+    merged = merge_reports(reports)
+
+    with open(args.output, 'w') as f:
+        json.dump(merged, f, indent=4, default=str)
+
+    print(f"Merged {len(reports)} reports: {merged['correct']}/{merged['total']} correct ({merged['%_correct']}%)")
+    print(f"Merged report saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
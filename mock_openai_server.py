@@ -0,0 +1,375 @@
+import argparse
+import ast
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import yaml
+
+'''
+Local stand-in for the subset of the OpenAI Responses API used by course_data_generator.py (POST /v1/responses), so that the
+generator can be benchmarked and regression tested offline.
+
+Responses are replayed from cassettes when possible. Cassettes are the response cache directories written by
+course_data_generator.py with --llm-cache. When no cassette matches a prompt, a structurally valid response is synthesized
+from the sample embedded in the prompt: the sample is echoed back with new names, titles and emails, so it passes validation.
+
+Latency, server errors and rate limiting can be injected to load test the concurrency and retry behaviour of the generator.
+Requests with "stream": true are answered with server-sent events, like the OpenAI API, and malformed responses can be injected
+to exercise the validation retries and streaming aborts of the generator.
+
+Example usage:
+
+Start the server, replaying the responses recorded by a previous generator run
+python mock_openai_server.py --cassettes llm_cache --port 8766
+
+Synthesize every response, with 0.5-2s of latency, 5% server errors and 5% rate limited requests
+python mock_openai_server.py --latency 0.5 2 --error-rate 0.05 --rate-limit-rate 0.05
+
+Stream responses at 20ms per chunk, with 10% of synthesized responses malformed
+python mock_openai_server.py --stream-delay 0.02 --malformed-rate 0.1
+
+Point the generator at the server
+python course_data_generator.py -i test_data.yaml -k mock --openai-base-url http://127.0.0.1:8766/v1
+'''
+
+parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI Responses API used by course_data_generator.py.")
+
+parser.add_argument('--host',
+                    dest="host",
+                    default="127.0.0.1",
+                    help="The interface to listen on.")
+
+parser.add_argument('-p', '--port',
+                    dest="port",
+                    default=8766,
+                    type=int,
+                    help="The TCP port to listen on.")
+
+parser.add_argument('--cassettes',
+                    dest="cassettes",
+                    help="Path to a response cache directory written by course_data_generator.py --llm-cache, whose responses are replayed.")
+
+parser.add_argument('--strict',
+                    dest="strict",
+                    action="store_true",
+                    help="Respond with an error rather than a synthesized response to prompts with no cassette.")
+
+parser.add_argument('--latency',
+                    dest="latency",
+                    nargs=2,
+                    type=float,
+                    default=[0, 0],
+                    metavar=("MIN", "MAX"),
+                    help="Seconds of latency added to every response, drawn uniformly between MIN and MAX.")
+
+parser.add_argument('--error-rate',
+                    dest="error_rate",
+                    type=float,
+                    default=0,
+                    help="Fraction of requests answered with a 500 server error.")
+
+parser.add_argument('--rate-limit-rate',
+                    dest="rate_limit_rate",
+                    type=float,
+                    default=0,
+                    help="Fraction of requests answered with a 429 rate limit error.")
+
+parser.add_argument('--malformed-rate',
+                    dest="malformed_rate",
+                    type=float,
+                    default=0,
+                    help="Fraction of synthesized responses nested under an unexpected top-level key, so they fail validation.")
+
+parser.add_argument('--stream-delay',
+                    dest="stream_delay",
+                    type=float,
+                    default=0,
+                    help="Seconds between the chunks of streamed responses.")
+
+parser.add_argument('--stream-chunk-size',
+                    dest="stream_chunk_size",
+                    type=int,
+                    default=16,
+                    help="Characters per chunk of streamed responses.")
+
+parser.add_argument('--rpm',
+                    dest="rpm",
+                    type=int,
+                    help="Requests per minute above which requests are answered with a 429 rate limit error, like an OpenAI usage tier.")
+
+parser.add_argument('--seed',
+                    dest="seed",
+                    type=int,
+                    help="Random seed, for reproducible latencies and errors.")
+
+
+'''
+Cassette lookup. The key must be computed exactly like LLM.cache_key() in course_data_generator.py, for the first candidate of a prompt.
+'''
+def cassette_key(model, instructions, input):
+    return hashlib.sha256(json.dumps([model, instructions, input]).encode('utf-8')).hexdigest()
+
+def replay(model, instructions, input):
+    if args.cassettes is None:
+        return None
+
+    key = cassette_key(model, instructions, input)
+    path = os.path.join(args.cassettes, key[:2], key + '.json')
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as cassette_file:
+        return json.load(cassette_file)['output_text']
+
+
+'''
+Synthesis of responses from the prompts built by Prompter in course_data_generator.py.
+'''
+synthesized_count = itertools.count(1)
+
+def extract_sample(input):
+    sample_search = re.search("(?<=```yaml\n).*?(?=```)", input, re.DOTALL)
+    if sample_search is None:
+        return None
+
+    # The templates indent the first line of the sample along with the rest of the prompt.
+    lines = sample_search.group(0).split('\n')
+    lines[0] = lines[0].lstrip()
+    return yaml.safe_load('\n'.join(lines))
+
+def vary(value, number, entity_name=None):
+    if isinstance(value, dict):
+        varied = {}
+        for key, _value in value.items():
+            if key in ['title', 'name'] and isinstance(_value, str):
+                varied[key] = entity_name if entity_name is not None else f"{_value} {number}"
+                entity_name = None
+            elif key == 'email' and isinstance(_value, str):
+                varied[key] = _value.replace('@', f"{number}@", 1)
+            else:
+                varied[key] = vary(_value, number)
+        return varied
+
+    if isinstance(value, list):
+        return [vary(x, number) for x in value]
+
+    # The generator expects dates as strings, like the LLM produces them.
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+
+    return value
+
+def synthesize(input, malformed=False):
+    number = next(synthesized_count)
+
+    if malformed and '```yaml' in input:
+        return "```yaml\n" + yaml.dump({"generated_output": vary(extract_sample(input), number)}, default_flow_style=False) + "```"
+
+    if 'Generate the name of a university level course' in input:
+        return f"Synthetic Course {number}"
+
+    # Modules prompt, reference the valid pages and assignments listed in the prompt.
+    valid_values_search = re.search(r"The only valid values for \[\[Page\]\] are (\[.*?\])\. The only valid values for \[\[Assignment\]\] are (\[.*?\])\.", input)
+    if valid_values_search is not None:
+        pages = ast.literal_eval(valid_values_search.group(1))
+        assignments = ast.literal_eval(valid_values_search.group(2))
+        modules = extract_sample(input)
+
+        for module_index, module in enumerate(modules['modules']):
+            module['name'] = f"Module {module_index + 1} {number}"
+            for content_index, content in enumerate(module['content']):
+                options = pages if 'completion_requirements' in content else assignments
+                content['title'] = options[(module_index + content_index) % len(options)] if len(options) > 0 else content['title']
+
+        return "```yaml\n" + yaml.dump(modules, default_flow_style=False) + "```"
+
+    sample = extract_sample(input)
+
+    # Names prompts, the sample is a list of names.
+    if isinstance(sample, list) and all([isinstance(x, str) for x in sample]):
+        return "```yaml\n" + yaml.dump([f"{x} {number}" for x in sample], default_flow_style=False) + "```"
+
+    # Batch prompts, the sample is a list of elements, named in order after 'called'.
+    if isinstance(sample, list):
+        entity_names_search = re.findall(r"called ((?:'[^']*'(?:, )?)+)", input)
+        entity_names = re.findall(r"'([^']*)'", entity_names_search[-1]) if len(entity_names_search) > 0 else []
+        varied = [vary(x, number, entity_names[i] if i < len(entity_names) else None) for i, x in enumerate(sample)]
+        return "```yaml\n" + yaml.dump(varied, default_flow_style=False) + "```"
+
+    # The entity name comes last, after any mention of fields called 'user'.
+    entity_name_search = re.findall(r"called '(.*?)'", input)
+    varied = vary(sample, number, entity_name_search[-1] if len(entity_name_search) > 0 else None)
+    return "```yaml\n" + yaml.dump(varied, default_flow_style=False) + "```"
+
+
+'''
+Rate limiting over a sliding one minute window, like OpenAI usage tiers.
+'''
+request_times = []
+request_times_lock = threading.Lock()
+
+def over_rate_limit():
+    if args.rpm is None:
+        return False
+
+    with request_times_lock:
+        now = time.time()
+        while len(request_times) > 0 and request_times[0] < now - 60:
+            request_times.pop(0)
+
+        if len(request_times) >= args.rpm:
+            return True
+
+        request_times.append(now)
+        return False
+
+
+def to_response(model, output_text, input):
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": model,
+        "output": [
+            {
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex}",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": output_text, "annotations": []}]
+            }
+        ],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        # Rough token counts, about 4 characters per token.
+        "usage": {
+            "input_tokens": len(input) // 4,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": len(output_text) // 4,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": len(input) // 4 + len(output_text) // 4
+        }
+    }
+
+
+class MockOpenAIRequestHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for header, value in (headers if headers is not None else {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, message, error_type, headers=None):
+        self.send_json(status, {"error": {"message": message, "type": error_type, "param": None, "code": None}}, headers)
+
+    '''
+    Streams a response as server-sent events: response.created, then output_text deltas of --stream-chunk-size characters
+    every --stream-delay seconds, then response.completed. Stops early if the client drops the connection, as the generator
+    does when it aborts a streamed response.
+    '''
+    def send_stream(self, model, output_text, input):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        response = to_response(model, output_text, input)
+        message_id = response['output'][0]['id']
+        sequence_number = itertools.count()
+
+        def send_event(event):
+            event['sequence_number'] = next(sequence_number)
+            self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            send_event({"type": "response.created", "response": dict(response, status="in_progress", output=[], usage=None)})
+
+            for start in range(0, len(output_text), args.stream_chunk_size):
+                if start > 0:
+                    time.sleep(args.stream_delay)
+                send_event({
+                    "type": "response.output_text.delta",
+                    "item_id": message_id,
+                    "output_index": 0,
+                    "content_index": 0,
+                    "delta": output_text[start:start + args.stream_chunk_size],
+                    "logprobs": []
+                })
+
+            send_event({"type": "response.completed", "response": response})
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"Client aborted streamed response {response['id']}.")
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/responses':
+            self.send_error_json(404, f"Unknown path: {self.path}", "invalid_request_error")
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        model = request.get('model')
+        instructions = request.get('instructions', "")
+        input = request.get('input', "")
+
+        with random_lock:
+            latency = random.uniform(args.latency[0], args.latency[1])
+            rate_limited = random.random() < args.rate_limit_rate
+            failed = random.random() < args.error_rate
+            malformed = random.random() < args.malformed_rate
+
+        if rate_limited or over_rate_limit():
+            self.send_error_json(429, "Rate limit reached, please try again later.", "requests", {"Retry-After": "1"})
+            return
+
+        time.sleep(latency)
+
+        if failed:
+            self.send_error_json(500, "The server had an error while processing your request.", "server_error")
+            return
+
+        output_text = replay(model, instructions, input)
+        if output_text is None:
+            if args.strict:
+                self.send_error_json(400, "No cassette matches this prompt.", "invalid_request_error")
+                return
+            output_text = synthesize(input, malformed)
+
+        if request.get('stream', False):
+            self.send_stream(model, output_text, input)
+            return
+
+        self.send_json(200, to_response(model, output_text, input))
+
+
+args = parser.parse_args()
+
+random.seed(args.seed)
+random_lock = threading.Lock()
+
+server = ThreadingHTTPServer((args.host, args.port), MockOpenAIRequestHandler)
+print(f"Mock OpenAI server listening on http://{args.host}:{args.port}/v1")
+
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    print("Shutting down mock OpenAI server.")
+finally:
+    server.server_close()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Persistent multi-run results store.
+
+Keeps the results of evaluation runs from different agents, task packs and dates in a single
+SQLite file, indexed by task instance id and task id, so cross-run questions become indexed
+lookups rather than re-reading every report.
+
+Runs can be appended directly by evaluation_script.py with --results-db, or imported from
+existing reports (.json or .jsonl) with the 'add' command.
+
+Example usage:
+python results_store.py -d results.db add webvoyager_odox_6d_results.json --run-id wv-odox-6d --agent webvoyager -t tasks.json
+python results_store.py -d results.db runs
+python results_store.py -d results.db compare wv-odox-6d odobot-odox-6d
+python results_store.py -d results.db flips wv-odox-6d odobot-odox-6d
+python results_store.py -d results.db history --task-id 9b30427c-2025-48db-baed-2cff271cd819
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from core import Task, iter_results
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    agent TEXT,
+    pack TEXT,
+    created_at TEXT NOT NULL,
+    source TEXT,
+    correct INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    instance_id TEXT NOT NULL,
+    task_id TEXT,
+    task_type TEXT,
+    correct INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (run_id, instance_id)
+);
+CREATE INDEX IF NOT EXISTS results_instance_id ON results (instance_id);
+CREATE INDEX IF NOT EXISTS results_task_id ON results (task_id);
+"""
+
+
+class ResultsStore:
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_run(self, run_id: str, results: Iterable[Dict], agent: Optional[str] = None, pack: Optional[str] = None, source: Optional[str] = None) -> Dict:
+        """
+        Store the task instance eval results of a run, replacing any run with the same id.
+
+        Task ids and types are looked up in the loaded task pack (Task.ALL_TASK_INSTANCES) when available.
+
+        Returns:
+            The stored run
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self.connection.execute(
+                "INSERT INTO runs (run_id, agent, pack, created_at, source) VALUES (?, ?, ?, ?, ?)",
+                (run_id, agent, pack, datetime.now().isoformat(timespec='seconds'), source)
+            )
+
+            def rows():
+                for result in results:
+                    instance = Task.ALL_TASK_INSTANCES.get(result['id'])
+                    yield (
+                        run_id,
+                        result['id'],
+                        instance.parent_task.id if instance is not None else None,
+                        instance.parent_task.type if instance is not None else None,
+                        1 if result['correct'] else 0,
+                        json.dumps(result, default=str)
+                    )
+
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results (run_id, instance_id, task_id, task_type, correct, result) VALUES (?, ?, ?, ?, ?, ?)",
+                rows()
+            )
+
+            self.connection.execute(
+                "UPDATE runs SET correct = (SELECT COALESCE(SUM(correct), 0) FROM results WHERE run_id = ?), total = (SELECT COUNT(*) FROM results WHERE run_id = ?) WHERE run_id = ?",
+                (run_id, run_id, run_id)
+            )
+
+        return self.get_run(run_id)
+
+    def get_run(self, run_id: str) -> Optional[Dict]:
+        row = self.connection.execute("SELECT run_id, agent, pack, created_at, source, correct, total FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return self._run(row) if row is not None else None
+
+    def list_runs(self) -> List[Dict]:
+        return [self._run(row) for row in self.connection.execute("SELECT run_id, agent, pack, created_at, source, correct, total FROM runs ORDER BY created_at, run_id")]
+
+    def _run(self, row) -> Dict:
+        run_id, agent, pack, created_at, source, correct, total = row
+        return {
+            'run_id': run_id,
+            'agent': agent,
+            'pack': pack,
+            'created_at': created_at,
+            'source': source,
+            'correct': correct,
+            'total': total,
+            '%_correct': round((correct / total) * 100, 2) if total > 0 else "N/A"
+        }
+
+    def compare_runs(self, run_ids: List[str]) -> Dict[str, Dict[str, Optional[bool]]]:
+        """
+        Returns:
+            Dict mapping instance_id -> {run_id: correct}, None for runs that did not evaluate the instance
+        """
+        placeholders = ', '.join('?' for _ in run_ids)
+        comparison = {}
+        for instance_id, run_id, correct in self.connection.execute(
+            f"SELECT instance_id, run_id, correct FROM results WHERE run_id IN ({placeholders}) ORDER BY instance_id", run_ids
+        ):
+            comparison.setdefault(instance_id, {x: None for x in run_ids})[run_id] = bool(correct)
+        return comparison
+
+    def flips(self, first_run_id: str, second_run_id: str) -> List[Dict]:
+        """
+        Returns:
+            The task instances evaluated in both runs whose verdict changed between them
+        """
+        return [
+            {'id': instance_id, 'task_id': task_id, first_run_id: bool(first_correct), second_run_id: bool(second_correct)}
+            for instance_id, task_id, first_correct, second_correct in self.connection.execute(
+                """SELECT a.instance_id, a.task_id, a.correct, b.correct FROM results a JOIN results b ON a.instance_id = b.instance_id
+                   WHERE a.run_id = ? AND b.run_id = ? AND a.correct != b.correct ORDER BY a.instance_id""",
+                (first_run_id, second_run_id)
+            )
+        ]
+
+    def task_history(self, task_id: str) -> List[Dict]:
+        """
+        Returns:
+            Per run pass counts for the instances of a task, oldest run first
+        """
+        return [
+            {'run_id': run_id, 'agent': agent, 'created_at': created_at, 'correct': correct, 'total': total}
+            for run_id, agent, created_at, correct, total in self.connection.execute(
+                """SELECT runs.run_id, runs.agent, runs.created_at, SUM(results.correct), COUNT(*) FROM results JOIN runs ON results.run_id = runs.run_id
+                   WHERE results.task_id = ? GROUP BY runs.run_id ORDER BY runs.created_at, runs.run_id""",
+                (task_id,)
+            )
+        ]
+
+    def instance_history(self, instance_id: str) -> List[Dict]:
+        """
+        Returns:
+            The eval results of a task instance in every run that evaluated it, oldest run first
+        """
+        return [
+            {'run_id': run_id, 'agent': agent, 'created_at': created_at, 'correct': bool(correct), 'result': json.loads(result)}
+            for run_id, agent, created_at, correct, result in self.connection.execute(
+                """SELECT runs.run_id, runs.agent, runs.created_at, results.correct, results.result FROM results JOIN runs ON results.run_id = runs.run_id
+                   WHERE results.instance_id = ? ORDER BY runs.created_at, runs.run_id""",
+                (instance_id,)
+            )
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent store of evaluation results across runs.')
+    parser.add_argument('-d', '--db', required=True, help='Path to the SQLite results store, created if it does not exist')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help='Import an evaluation report (.json or .jsonl) as a run')
+    add_parser.add_argument('results_file', help='Path to the evaluation report')
+    add_parser.add_argument('--run-id', help='Id of the run, defaults to the report file name')
+    add_parser.add_argument('--agent', help='Name of the agent (configuration) that produced the run')
+    add_parser.add_argument('--pack', help='Name of the task pack the run was evaluated against')
+    add_parser.add_argument('-t', '--tasks', dest='tasks_file', help='Path to the tasks.json file, used to record task ids and types')
+
+    subparsers.add_parser('runs', help='List stored runs')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare task instance verdicts across runs')
+    compare_parser.add_argument('run_ids', nargs='+', help='Ids of the runs to compare')
+
+    flips_parser = subparsers.add_parser('flips', help='List task instances whose verdict changed between two runs')
+    flips_parser.add_argument('first_run_id')
+    flips_parser.add_argument('second_run_id')
+
+    history_parser = subparsers.add_parser('history', help='Show the history of a task or task instance across runs')
+    history_group = history_parser.add_mutually_exclusive_group(required=True)
+    history_group.add_argument('--task-id', help='Id of the task')
+    history_group.add_argument('--instance-id', help='Id of the task instance')
+
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+
+    if args.command == 'add':
+        if args.tasks_file:
+            with open(args.tasks_file, 'r') as f:
+                [Task(x) for x in json.load(f)]
+
+        run_id = args.run_id if args.run_id else os.path.splitext(os.path.basename(args.results_file))[0]
+        run = store.add_run(run_id, iter_results(args.results_file), agent=args.agent, pack=args.pack if args.pack else args.tasks_file, source=os.path.abspath(args.results_file))
+        print(f"Stored run {run['run_id']}: {run['correct']}/{run['total']} correct ({run['%_correct']}%)")
+
+    elif args.command == 'runs':
+        print(f"{'RUN ID':<40} | {'AGENT':<20} | {'CREATED AT':<19} | {'CORRECT':<9} | % CORRECT")
+        for run in store.list_runs():
+            print(f"{run['run_id']:<40} | {str(run['agent']):<20} | {run['created_at']:<19} | {str(run['correct']) + '/' + str(run['total']):<9} | {run['%_correct']}")
+
+    elif args.command == 'compare':
+        missing = [run_id for run_id in args.run_ids if store.get_run(run_id) is None]
+        if missing:
+            print(f"Error: unknown run(s): {missing}")
+            sys.exit(1)
+
+        def verdict(correct):
+            return '-' if correct is None else ('PASS' if correct else 'FAIL')
+
+        print(' | '.join([f"{'INSTANCE ID':<36}"] + [f"{run_id:<10}" for run_id in args.run_ids]))
+        for instance_id, verdicts in store.compare_runs(args.run_ids).items():
+            print(' | '.join([f"{instance_id:<36}"] + [f"{verdict(verdicts[run_id]):<10}" for run_id in args.run_ids]))
+
+    elif args.command == 'flips':
+        flips = store.flips(args.first_run_id, args.second_run_id)
+        for flip in flips:
+            print(f"{flip['id']}: {'PASS' if flip[args.first_run_id] else 'FAIL'} -> {'PASS' if flip[args.second_run_id] else 'FAIL'}")
+        print(f"{len(flips)} task instance(s) changed verdict between {args.first_run_id} and {args.second_run_id}")
+
+    elif args.command == 'history':
+        if args.task_id:
+            for entry in store.task_history(args.task_id):
+                print(f"{entry['run_id']} ({entry['agent']}, {entry['created_at']}): {entry['correct']}/{entry['total']} correct")
+        else:
+            for entry in store.instance_history(args.instance_id):
+                print(f"{entry['run_id']} ({entry['agent']}, {entry['created_at']}): {'PASS' if entry['correct'] else 'FAIL'}")
+
+    store.close()
+
+
+if __name__ == '__main__':
+    main()